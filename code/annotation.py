@@ -1,19 +1,31 @@
 
 import os
 import re
-import json
+import hashlib
+import shutil
+import difflib
+import weakref
+import threading
 from io import StringIO
 from pathlib import Path
-from collections import namedtuple
-
-from git import Repo
+from collections import namedtuple, OrderedDict
 
 import utils
 import config
+import render
+import timing
 
 
 Comparison = namedtuple('Comparison', ['in_both', 'in_first', 'in_second'])
 
+Changes = namedtuple('Changes', ['added', 'removed', 'modified'])
+
+# SHA of a tree without entries, git knows about it even if no commit has it
+EMPTY_TREE = '4b825dc642cb6eb9a060e54bf8d69288fbee4904'
+
+# Version of the manifest layout, manifests with another version are ignored.
+MANIFEST_VERSION = 4
+
 
 class Repository:
 
@@ -21,19 +33,164 @@ class Repository:
 
     def __init__(self, directory: str):
         self.path = Path(directory)
-        self.repo = Repo(directory)
+        self.root = self.path
+        # GitPython is imported when the repository is first needed, a warm start
+        # from a manifest does not need it
+        self._repo = None
+        self._branches = None
+        self._branch_names = None
+        # snapshots of branches, indexed on the commit SHA
+        self._snapshots = {}
+        self._snapshots_lock = threading.Lock()
+        # comparisons of branches, indexed on their names and commit SHAs
+        self._comparisons = OrderedDict()
+        self._worktrees = None
+        self._overlaps = None
+        # history of the branches, made when first asked for
+        self._history = None
         self.load()
 
     def __str__(self):
         return f'<{self.__class__.__name__} "{self.path.name}">'
 
+    @property
+    def repo(self):
+        if self._repo is None:
+            from git import Repo
+            self._repo = Repo(self.path)
+        return self._repo
+
+    @timing.timed('annotations.load')
     def load(self):
-        """Load repository data."""
-        self.readme = Path(self.path / 'README.md').open().read()
-        self._batches = { p.stem: Batch(p) for p in self.batch_files }
-        self._tasks = { p.stem: Task(self, p) for p in self.task_directories() }
-        self._branch_names = [ str(branch) for branch in self.repo.branches ]
-        self._branches = { str(branch): branch for branch in self.repo.branches }
+        """Load repository data. This uses the cached manifest for the current
+        state of the repository if there is one, and creates it if there is not."""
+        if self.warm_start():
+            return
+        key = self.manifest_key()
+        manifest = utils.read_cache(key) if key is not None else None
+        if manifest is not None and manifest.get('version') == MANIFEST_VERSION:
+            self.restore(manifest)
+        else:
+            self.readme = utils.read_file(self.root / 'README.md')
+            batch_files = self.batch_files
+            batches = self.map(Batch, batch_files)
+            self._batches = { p.stem: batch for p, batch in zip(batch_files, batches) }
+            self._tasks = { p.stem: Task(self, p) for p in self.task_directories() }
+            self._signatures = self.signatures()
+            if key is not None:
+                self.save_manifest(key)
+        self._overlaps = None
+        self._branches = self._branch_names = None
+        timing.add_objects(len(self._batches) + len(self._tasks))
+
+    def warm_start(self):
+        """Load the repository from the manifest that was last saved for the working
+        tree at the current HEAD and then bring it up to date like refresh() does.
+        HEAD is read from the files in the .git directory, so this does not import
+        GitPython and only needs stat calls on directories that did not change.
+        Returns False if there is no such manifest."""
+        if isinstance(self.root, utils.GitPath):
+            return False
+        head = utils.read_head(self.path)
+        manifest = utils.read_cache(self.warm_key(head)) if head is not None else None
+        if manifest is None or manifest.get('version') != MANIFEST_VERSION:
+            return False
+        self.restore(manifest)
+        self._overlaps = None
+        self._branches = self._branch_names = None
+        if self.update():
+            # there are uncommitted changes that the manifest did not have
+            key = self.manifest_key()
+            if key is not None:
+                self.save_manifest(key)
+        timing.add_objects(len(self._batches) + len(self._tasks))
+        return True
+
+    def map(self, function, items):
+        """Map a function over items with a pool of threads. GitPython is not thread
+        safe so repositories that are read from git objects use one thread."""
+        threads = 1 if isinstance(self.root, utils.GitPath) else None
+        return utils.parallel_map(function, items, threads)
+
+    def load_branches(self):
+        branches = { str(branch): branch for branch in self.repo.branches }
+        self._branch_names = list(branches)
+        self._branches = branches
+
+    def signatures(self):
+        """Return signatures for the readme, all batches and all tasks, these are
+        used to find out what changed when the repository is refreshed."""
+        signatures = { 'readme': utils.signature(self.root / 'README.md') }
+        for name, batch in self._batches.items():
+            signatures[f'batch:{name}'] = utils.signature(batch.path)
+        task_signatures = self.map(Task.signature, self._tasks.values())
+        for name, task_signature in zip(self._tasks, task_signatures):
+            signatures[f'task:{name}'] = task_signature
+        return signatures
+
+    @timing.timed('annotations.refresh')
+    def refresh(self):
+        """Pick up changes in the working tree without doing a full load. This looks
+        at the modification times and sizes of files and directories and rebuilds
+        only those batches and tasks that were added or changed since the last load
+        or refresh. Returns the names of the batches and tasks that were rebuilt or
+        removed, prefixed with "batch:" or "task:"."""
+        changed = self.update()
+        # branches are listed again when they are next needed
+        self._branches = self._branch_names = None
+        if changed:
+            key = self.manifest_key()
+            if key is not None:
+                self.save_manifest(key)
+        return changed
+
+    def update(self):
+        """Rebuild the batches and tasks that changed, this is refresh() without
+        anything that needs git."""
+        # Changes are made to copies which then replace the originals, so other
+        # threads never see a dictionary that is being changed.
+        changed = []
+        signatures = { 'readme': utils.signature(self.root / 'README.md') }
+        if signatures['readme'] != self._signatures.get('readme'):
+            self.readme = utils.read_file(self.root / 'README.md')
+            changed.append('readme')
+        batches = dict(self._batches)
+        batch_paths = { p.stem: p for p in self.batch_files }
+        for name in set(batches) - set(batch_paths):
+            del batches[name]
+            changed.append(f'batch:{name}')
+        for name, path in batch_paths.items():
+            key = f'batch:{name}'
+            signatures[key] = utils.signature(path)
+            if signatures[key] != self._signatures.get(key):
+                batches[name] = Batch(path)
+                changed.append(key)
+        tasks = dict(self._tasks)
+        task_paths = { p.stem: p for p in self.task_directories() }
+        for name in set(tasks) - set(task_paths):
+            del tasks[name]
+            changed.append(f'task:{name}')
+        current = [tasks[name] if name in tasks else Task(self, path)
+                   for name, path in task_paths.items()]
+        task_signatures = self.map(Task.signature, current)
+        for (name, path), task, task_signature in zip(
+                task_paths.items(), current, task_signatures):
+            key = f'task:{name}'
+            if task_signature != self._signatures.get(key):
+                # a task that was already loaded keeps its old data drops and so
+                # its signature, the signature is taken from the rebuilt task
+                if name in tasks:
+                    task = Task(self, path)
+                    task_signature = task.signature()
+                tasks[name] = task
+                changed.append(key)
+            signatures[key] = task_signature
+        self._batches = batches
+        self._tasks = tasks
+        if changed:
+            self._overlaps = None
+        self._signatures = signatures
+        return changed
 
     @property
     def tasks(self):
@@ -53,31 +210,170 @@ class Repository:
 
     @property
     def batch_files(self):
-        return [p for p in Path(self.path / 'batches').iterdir()]
+        return [p for p in (self.root / 'batches').iterdir()]
 
     @property
     def branches(self):
-      return self._branches
+        if self._branches is None:
+            self.load_branches()
+        return self._branches
 
     @property
     def branch_names(self):
+        if self._branch_names is None:
+            self.load_branches()
         return self._branch_names
    
     def task_directories(self):
         # TODO: now depends on there being a golds sub directory, should perhaps
         # instead check presence of readme and process.py files.
-        return [ p for p in self.path.iterdir() if Path(p / 'golds').is_dir()]
+        directories = [p for p, is_dir in utils.scan_directory(self.root) if is_dir]
+        has_golds = self.map(lambda p: (p / 'golds').is_dir(), directories)
+        return [p for p, golds in zip(directories, has_golds) if golds]
 
     def task(self, task: str):
         return self._tasks[task]
 
+    @property
+    @timing.timed('annotations.overlaps')
+    def overlaps(self):
+        """The overlap matrix for all tasks and batches, made when first needed and
+        again after a load or a refresh that changed something."""
+        overlaps = self._overlaps
+        if overlaps is None:
+            overlaps = OverlapMatrix(self._tasks, self._batches)
+            self._overlaps = overlaps
+        return overlaps
+
+    def comparison(self, task: str, batch: str):
+        """Compare the gold files of a task to the files in a batch. This gives the
+        same result as Task.compare_to_batch(), but is a lookup in the matrix."""
+        return self.overlaps.comparison(task, batch)
+
     def batch(self, name: str):
         return self._batches[name]
 
+    @timing.timed('annotations.checkout')
     def checkout(self, branch: str):
         self.branches[branch].checkout()
         self.load()
 
+    def manifest_key(self):
+        """Return the name of the manifest for the working tree. It combines the SHA
+        of HEAD with a fingerprint of all uncommitted changes, where the latter uses
+        the output of git-status and the size and modification time of the changed
+        files. Returns None if there is no commit to key on."""
+        try:
+            head = self.repo.head.commit.hexsha
+        except ValueError:
+            return None
+        status = self.repo.git.status('--porcelain', '-z', '--untracked-files=all')
+        fingerprint = hashlib.sha1(status.encode('utf8'))
+        for entry in status.split('\0'):
+            path = self.path / entry[3:]
+            if entry and path.is_file():
+                stat = path.stat()
+                fingerprint.update(f'{stat.st_mtime_ns}:{stat.st_size}'.encode('utf8'))
+        return f'manifest-{self.path.resolve().name}-{head}-{fingerprint.hexdigest()[:16]}'
+
+    def warm_key(self, head: str):
+        return f'warm-{self.path.resolve().name}-{head}'
+
+    def save_manifest(self, key: str):
+        """Save the manifest and, for a working tree, save it as the manifest to
+        start from the next time the repository is loaded at the same HEAD."""
+        manifest = self.manifest()
+        utils.write_cache(key, manifest)
+        if not isinstance(self.root, utils.GitPath):
+            head = utils.read_head(self.path)
+            if head is not None:
+                utils.write_cache(self.warm_key(head), manifest)
+
+    def manifest(self):
+        """Return a dictionary with all the repository data that is expensive to
+        collect from the files, in a form that can be saved as JSON."""
+        return {
+            'version': MANIFEST_VERSION,
+            'readme': self.readme,
+            'batches': {
+                name: { 'file': batch.name, 'files': batch.files, 'comment': batch.comment }
+                for name, batch in self._batches.items() },
+            'tasks': dict(zip(self._tasks, self.map(Task.manifest, self._tasks.values()))),
+            'signatures': self._signatures }
+
+    def restore(self, manifest: dict):
+        """Load repository data from a manifest instead of from the files."""
+        self.readme = manifest['readme']
+        self._batches = {
+            name: Batch.from_manifest(
+                self.root / 'batches' / data['file'], data['files'], data['comment'])
+            for name, data in manifest['batches'].items() }
+        self._tasks = {
+            name: Task.from_manifest(self, self.root / name, data)
+            for name, data in manifest['tasks'].items() }
+        self._signatures = manifest['signatures']
+
+    def head_commit(self, branch: str):
+        """Return the commit at the head of a branch. GitPython resolves it through
+        a git process that all threads share, so this is done under the git lock."""
+        with utils.git_lock(self.repo):
+            commit = self.branches[branch].commit
+            commit.hexsha
+        return commit
+
+    def snapshot(self, branch: str):
+        """Return a read-only view of the repository at the head of a branch. This
+        is built from the git objects and does not check out anything. Snapshots
+        are memoized by commit SHA so returning to a branch is cheap."""
+        commit = self.head_commit(branch)
+        with self._snapshots_lock:
+            if commit.hexsha not in self._snapshots:
+                self._snapshots[commit.hexsha] = Snapshot(self, commit)
+            return self._snapshots[commit.hexsha]
+
+    @timing.timed('annotations.compare')
+    def compare(self, first: str, second: str):
+        """Return what changed in the repository between two branches or commits,
+        see BranchComparison. Nothing is checked out and no files are read. The
+        comparisons are memoized by commit SHA, so a comparison is only made again
+        when one of the branches moved."""
+        with utils.git_lock(self.repo):
+            shas = (self.repo.commit(first).hexsha, self.repo.commit(second).hexsha)
+        key = (first, second) + shas
+        with self._snapshots_lock:
+            if key in self._comparisons:
+                self._comparisons.move_to_end(key)
+                return self._comparisons[key]
+        comparison = BranchComparison(self.repo, first, second)
+        with self._snapshots_lock:
+            self._comparisons[key] = comparison
+            while len(self._comparisons) > config.COMPARISON_CACHE_SIZE:
+                self._comparisons.popitem(last=False)
+        return comparison
+
+    def history(self, branch: str):
+        """Return the timeline of a branch with gold file counts, batch sizes and
+        data drop arrivals for each commit, see history.History. Nothing is checked
+        out and only commits that were not seen before are looked at."""
+        with self._snapshots_lock:
+            if self._history is None:
+                import history
+                self._history = history.History(self.path)
+        return self._history.timeline(branch)
+
+    def at_branch(self, branch: str):
+        """Return the repository at the head of a branch, either as a snapshot or,
+        if config.WORKTREES is set, as a repository in its own git worktree. Both
+        leave the main working tree alone so that sessions can look at different
+        branches at the same time."""
+        if config.WORKTREES:
+            with self._snapshots_lock:
+                if self._worktrees is None:
+                    self._worktrees = WorktreePool(
+                        self, Path(config.CACHE) / 'worktrees', config.WORKTREE_POOL_SIZE)
+            return self._worktrees.get(branch)
+        return self.snapshot(branch)
+
     def pp(self):
         print(f'\n{self}')
         print(f'\nActive branch:\n    {self.repo.active_branch}')
@@ -90,85 +386,414 @@ class Repository:
         print()
 
 
+class Snapshot(Repository):
+
+    """The repository as it is in a commit, with all data read from git trees and
+    blobs instead of from the working tree."""
+
+    def __init__(self, repository: Repository, commit):
+        self.path = repository.path
+        self._repo = repository.repo
+        self._branches = repository._branches
+        self._branch_names = repository._branch_names
+        self.commit = commit
+        with utils.git_lock(repository.repo):
+            self.root = utils.GitPath(commit.tree)
+        self._snapshots = repository._snapshots
+        self._snapshots_lock = repository._snapshots_lock
+        self._comparisons = repository._comparisons
+        self._overlaps = None
+        self._history = None
+        self.load()
+
+    def __str__(self):
+        return f'<{self.__class__.__name__} "{self.path.name}" {self.commit.hexsha[:8]}>'
+
+    def checkout(self, branch: str):
+        raise TypeError('snapshots are read-only, use snapshot() instead')
+
+    def manifest_key(self):
+        return f'manifest-{self.path.resolve().name}-{self.commit.hexsha}'
+
+    def refresh(self):
+        # a commit never changes, new commits on a branch are picked up by snapshot()
+        return []
+
+
+class OverlapMatrix:
+
+    """Overlap between gold files for all tasks and GUIDs of all batches. The GUIDs
+    are dictionary-encoded and each task and batch is stored as a bitset, so every
+    cell in the matrix is an AND and a bit count on two integers."""
+
+    def __init__(self, tasks: dict, batches: dict, guids: utils.GuidIndex = utils.GUIDS):
+        # tasks and batches are dictionaries indexed on the names used by Repository
+        self.task_names = sorted(tasks)
+        self.batch_names = sorted(batches)
+        self.tasks = { name: guids.bitset(task.gold_file_ids()) for name, task in tasks.items() }
+        self.batches = { name: guids.bitset(batch.files) for name, batch in batches.items() }
+        task_sizes = { name: utils.popcount(bits) for name, bits in self.tasks.items() }
+        batch_sizes = { name: utils.popcount(bits) for name, bits in self.batches.items() }
+        self.matrix = {}
+        for task_name, task_bits in self.tasks.items():
+            for batch_name, batch_bits in self.batches.items():
+                in_both = utils.popcount(task_bits & batch_bits)
+                self.matrix[(task_name, batch_name)] = Comparison(
+                    in_both, task_sizes[task_name] - in_both, batch_sizes[batch_name] - in_both)
+
+    def comparison(self, task: str, batch: str):
+        return self.matrix[(task, batch)]
+
+    def task_row(self, task: str):
+        """Return pairs of batch names and comparisons for a task."""
+        return [(batch, self.matrix[(task, batch)]) for batch in self.batch_names]
+
+    def batch_column(self, batch: str):
+        """Return pairs of task names and comparisons for a batch."""
+        return [(task, self.matrix[(task, batch)]) for task in self.task_names]
+
+
+class BranchComparison:
+
+    """The differences between two branches or commits, split up in changes to the
+    gold files and data drops of each task, changes to batch files and changes to
+    other files. This uses git-diff-tree, which compares the trees of the commits
+    on the SHAs of their entries, so sub trees that are the same are skipped and
+    no file content is read. Line differences for a file are made on request."""
+
+    def __init__(self, repo, first: str, second: str):
+        self.repo = repo
+        # commits and their trees are read through the cat-file process of the
+        # repository, which other threads use as well
+        with utils.git_lock(repo):
+            self.first = repo.commit(first)
+            self.second = repo.commit(second)
+            self.first.tree, self.second.tree
+        self.first_name = first
+        self.second_name = second
+        # dictionaries of task names or data drop paths to Changes, the lists in
+        # Changes have paths relative to the gold directory or the data drop
+        self.golds = {}
+        self.data_drops = {}
+        self.batches = Changes([], [], [])
+        self.other = Changes([], [], [])
+        for status, path in diff_tree(repo, self.first.hexsha, self.second.hexsha):
+            self.add(status, path)
+
+    def __str__(self):
+        return (f'<{self.__class__.__name__} {self.first_name}..{self.second_name}'
+                f' tasks={len(self.golds)} batches={self.batch_count}>')
+
+    def add(self, status: str, path: str):
+        parts = path.split('/')
+        if len(parts) == 2 and parts[0] == 'batches':
+            changes, name = self.batches, parts[1]
+        elif len(parts) > 2 and parts[1] == 'golds':
+            changes = self.golds.setdefault(parts[0], Changes([], [], []))
+            name = '/'.join(parts[2:])
+        elif len(parts) > 2 and re.match(r'\d{6}', parts[1]):
+            changes = self.data_drops.setdefault(
+                '/'.join(parts[:2]), Changes([], [], []))
+            name = '/'.join(parts[2:])
+        else:
+            changes, name = self.other, path
+        add_change(changes, status, name)
+
+    @property
+    def batch_count(self):
+        return sum(len(names) for names in self.batches)
+
+    def task_summary(self):
+        """Return rows with the task name and the number of added, removed and
+        modified gold files, for all tasks with changes in their golds."""
+        return [[task, len(changes.added), len(changes.removed), len(changes.modified)]
+                for task, changes in sorted(self.golds.items())]
+
+    def gold_changes(self, task: str):
+        return self.golds.get(task, Changes([], [], []))
+
+    def line_diff(self, path: str, context: int = 3):
+        """Return a unified diff of a file in the two commits, the path is relative
+        to the root of the repository. Only the two blobs of the file are read."""
+        first = utils.GitPath(self.first.tree) / path
+        second = utils.GitPath(self.second.tree) / path
+        first_lines = first.read_text().splitlines(keepends=True) if first.is_file() else []
+        second_lines = second.read_text().splitlines(keepends=True) if second.is_file() else []
+        timing.add_bytes(sum(len(line) for line in first_lines + second_lines))
+        return ''.join(difflib.unified_diff(
+            first_lines, second_lines, fromfile=f'{self.first_name}/{path}',
+            tofile=f'{self.second_name}/{path}', n=context))
+
+    def gold_diff(self, task: str, gold_file: str, context: int = 3):
+        return self.line_diff(f'{task}/golds/{gold_file}', context)
+
+
+def diff_tree(repo, first: str, second: str):
+    """Return status and path pairs for all files that differ between two trees or
+    commits, where the status is A for added, D for deleted and M for modified. A
+    change of file type counts as modified and renames are given as a deletion
+    and an addition."""
+    output = repo.git.diff_tree('-r', '-z', '--no-renames', '--name-status', first, second)
+    fields = output.split('\0')
+    return [(fields[i][0], fields[i + 1]) for i in range(0, len(fields) - 1, 2)]
+
+
+def add_change(changes: Changes, status: str, name: str):
+    if status == 'A':
+        changes.added.append(name)
+    elif status == 'D':
+        changes.removed.append(name)
+    else:
+        changes.modified.append(name)
+
+
+class WorktreePool:
+
+    """A bounded pool of git worktrees, each with the repository checked out at the
+    commit of a branch. Worktrees are indexed on the commit SHA so that a branch
+    that moves gets a fresh worktree, and the least recently used worktree is
+    dropped when the pool is full. A session can still be showing the repository
+    of a dropped worktree, so the worktree is only removed once its repository is
+    not used anymore."""
+
+    def __init__(self, repository: Repository, directory: Path, size: int):
+        self.repository = repository
+        self.directory = Path(directory).resolve()
+        self.size = size
+        self._worktrees = OrderedDict()
+        # worktrees dropped from the pool, with weak references to their repositories
+        self._retired = {}
+        # locks for worktrees that are being made, indexed on the commit SHA
+        self._loading = {}
+        self._lock = threading.Lock()
+        self.repository.repo.git.worktree('prune')
+
+    def __len__(self):
+        return len(self._worktrees)
+
+    def get(self, branch: str):
+        """Return a Repository for the worktree of the branch, creating the worktree
+        if needed. Loading the repository is done outside of the pool lock so that
+        other sessions do not have to wait for it, the lock for the SHA keeps two
+        sessions from making the same worktree."""
+        sha = self.repository.head_commit(branch).hexsha
+        with self._lock:
+            self.sweep()
+            repository = self.lookup(sha)
+            if repository is not None:
+                return repository
+            loading = self._loading.setdefault(sha, threading.Lock())
+        with loading:
+            with self._lock:
+                repository = self.lookup(sha)
+            if repository is None:
+                path = self.directory / sha
+                if not path.is_dir():
+                    self.directory.mkdir(parents=True, exist_ok=True)
+                    self.repository.repo.git.worktree('add', '--detach', str(path), sha)
+                repository = Repository(path)
+                with self._lock:
+                    self.add(sha, repository)
+                    self._loading.pop(sha, None)
+        return repository
+
+    def lookup(self, sha: str):
+        """Return the repository for a commit if it is in the pool or if it was
+        dropped but is still used, in which case it goes back into the pool. Call
+        this with the pool lock held."""
+        if sha in self._worktrees:
+            self._worktrees.move_to_end(sha)
+            return self._worktrees[sha]
+        if sha in self._retired:
+            repository = self._retired.pop(sha)()
+            if repository is not None:
+                self.add(sha, repository)
+            return repository
+        return None
+
+    def add(self, sha: str, repository: Repository):
+        self._worktrees[sha] = repository
+        while len(self._worktrees) > self.size:
+            retired_sha, retired = self._worktrees.popitem(last=False)
+            self._retired[retired_sha] = weakref.ref(retired)
+
+    def sweep(self):
+        """Remove the worktrees of dropped repositories that are not used anymore."""
+        for sha, reference in list(self._retired.items()):
+            if reference() is None:
+                del self._retired[sha]
+                self.remove(sha)
+
+    def remove(self, sha: str):
+        path = self.directory / sha
+        try:
+            self.repository.repo.git.worktree('remove', '--force', str(path))
+        except Exception:
+            shutil.rmtree(path, ignore_errors=True)
+            self.repository.repo.git.worktree('prune')
+
+
 class Batch(utils.FileSystemNode):
 
+    """A batch file with a list of GUIDs. The GUIDs are kept as an array of their
+    identifiers in utils.GUIDS and the file content is read again when needed."""
+
+    __slots__ = ('_guids', 'comment')
+
     def __init__(self, path: Path):
         super().__init__(path)
-        self.files = []
-        with open(path) as fh:
-            lines = fh.readlines()
-            self.files = [l.strip() for l in lines if not l.strip().startswith('#')]
-            self.content = ''.join(lines)
-        self._comment = None
+        with path.open() as fh:
+            content = fh.read()
+        self._guids = utils.GUIDS.identifiers(self.read_guids(content))
+        self.comment = self.read_comment(content)
+
+    @classmethod
+    def from_manifest(cls, path: Path, files: list, comment: str):
+        batch = cls.__new__(cls)
+        utils.FileSystemNode.__init__(batch, path)
+        batch._guids = utils.GUIDS.identifiers(files)
+        batch.comment = comment
+        return batch
 
     def __len__(self):
-        return len(self.files)
-
-    @property
-    def comment(self):
-        if self._comment is None:
-            comment = StringIO()
-            separator_count = 0
-            lines = self.content.split('\n')
-            for line in lines:
-                if '-' * 50 in line:
-                    separator_count += 1
-                    if separator_count == 2:
-                        break
-                    else:
-                        continue
-                if not line.startswith('#'):
+        return len(self._guids)
+
+    @property
+    def files(self):
+        return utils.GUIDS.strings(self._guids)
+
+    @property
+    def content(self):
+        return utils.read_file(self.path)
+
+    @staticmethod
+    def read_guids(content: str):
+        lines = StringIO(content).readlines()
+        return [l.strip() for l in lines if not l.strip().startswith('#')]
+
+    @staticmethod
+    def read_comment(content: str):
+        comment = StringIO()
+        separator_count = 0
+        lines = content.split('\n')
+        for line in lines:
+            if '-' * 50 in line:
+                separator_count += 1
+                if separator_count == 2:
                     break
-                line = line.lstrip('#').strip()
-                line = '\n' if not line else line
-                comment.write(f'{line}\n')
-            self._comment = comment.getvalue()
-            #print(f'COMMENT:\n{self._comment}<<<')
-        return self._comment
+                else:
+                    continue
+            if not line.startswith('#'):
+                break
+            line = line.lstrip('#').strip()
+            line = '\n' if not line else line
+            comment.write(f'{line}\n')
+        return comment.getvalue()
 
     def pp(self):
-        print(f'\n{b}\n\n{b.content[:500]}\n')
+        print(f'\n{self}\n\n{self.content[:500]}\n')
 
 
 class Task(utils.FileSystemNode):
 
+    __slots__ = ('_gold_directory', '_gold_names', '_gold_tree', 'readme_file',
+                 'process_file', '_data_drops')
+
     def __init__ (self, rep: Repository, path: Path):
+        # Nothing is read here, the data drops and the names of the gold files are
+        # collected when they are first needed, the readme and the process code
+        # are read each time they are asked for.
         super().__init__(path)
-        self.path = path
-        self._gold_directory = Path(path / 'golds')
-        self._gold_files = None
-        self.readme_file = Path(path / 'readme.md')
-        self.readme = utils.read_file(self.readme_file)
-        self.process_file = Path(path / 'process.py')
-        self.process = self.process_content()
-        self.data_drops = {}
-        for subdir in self.path.iterdir():
-            if subdir.is_dir() and re.match(r'\d{6}', subdir.name):
-                self.data_drops[subdir.name] = DataDrop(subdir)
+        self._gold_directory = path / 'golds'
+        self._gold_names = None
+        self._gold_tree = None
+        self.readme_file = path / 'readme.md'
+        self.process_file = path / 'process.py'
+        self._data_drops = None
+
+    @classmethod
+    def from_manifest(cls, rep: Repository, path: Path, manifest: dict):
+        task = cls(rep, path)
+        task._gold_names = tuple(manifest['gold_files'])
+        task._data_drops = {
+            name: DataDrop(path / name) for name in manifest['data_drops'] }
+        return task
 
     def __str__(self):
         return f'<Task "{self.path}">'
 
     def __len__(self):
-        return len(self.gold_files)
+        return len(self.gold_file_names)
+
+    @property
+    def readme(self):
+        return utils.read_file(self.readme_file)
+
+    @property
+    def process(self):
+        return self.process_content()
+
+    @property
+    def data_drops(self):
+        if self._data_drops is None:
+            self._data_drops = {}
+            for subdir, is_dir in utils.scan_directory(self.path):
+                if is_dir and re.match(r'\d{6}', subdir.name):
+                    self._data_drops[subdir.name] = DataDrop(subdir)
+        return self._data_drops
 
     @property
     def gold_directory(self):
         return self._gold_directory
     
+    @property
+    def gold_tree(self):
+        """Index of the gold directory with file counts and sizes for each directory."""
+        if self._gold_tree is None:
+            self._gold_tree = utils.DirectoryTree(self._gold_directory)
+        return self._gold_tree
+
+    @property
+    def gold_file_names(self):
+        """Paths of the gold files relative to the gold directory."""
+        # Files in the gold directory and everything in its sub directories, this
+        # does not go deeper than that. The tree is kept so that the gold directory
+        # is not walked again when the tree is wanted for display.
+        if self._gold_names is None:
+            tree = self.gold_tree
+            gold_names = []
+            for name in tree.root.entries:
+                if name in tree.root.files:
+                    gold_names.append(name)
+                else:
+                    directory = tree.root.subdirectories[name]
+                    gold_names.extend(f'{name}/{entry}' for entry in directory.entries)
+            self._gold_names = tuple(gold_names)
+        return self._gold_names
+
     @property
     def gold_files(self):
-        if self._gold_files is None:
-            self._gold_files = []
-            if self._gold_directory.is_dir():
-                for path in sorted(self._gold_directory.iterdir()):
-                    if path.is_file():
-                        self._gold_files.append(path)
-                    else:
-                        for subpath in sorted(path.iterdir()):
-                            self._gold_files.append(subpath)
-        return self._gold_files
+        return [self._gold_directory / name for name in self.gold_file_names]
     
+    def signature(self):
+        """Return a signature that changes when anything in the task changes, except
+        for edits of files in the gold directory and the data drops, which are not
+        cached anyway. For a task read from git this is just the tree SHA."""
+        if isinstance(self.path, utils.GitPath):
+            return self.path.hexsha
+        paths = [self.path, self.readme_file, self.process_file, self._gold_directory]
+        if self._gold_directory.is_dir():
+            paths.extend(p for p, is_dir in utils.scan_directory(self._gold_directory) if is_dir)
+        paths.extend(self.path / name for name in self.data_drops)
+        return [utils.signature(p) for p in paths]
+
+    def manifest(self):
+        """Return the data needed to recreate the task without listing directories.
+        File contents are not included since they are read lazily anyway."""
+        return {
+            'gold_files': list(self.gold_file_names),
+            'data_drops': list(self.data_drops) }
+
     def process_content(self):
         if self.process_file.is_file():
             with self.process_file.open() as fh:
@@ -176,17 +801,35 @@ class Task(utils.FileSystemNode):
         return ''
 
     def gold_file_ids(self):
-        return [f.stem for f in self.gold_files]
+        return [Path(name).stem for name in self.gold_file_names]
 
     def data_drop(self, data_drop: str):
         return self.data_drops.get(data_drop)
 
+    def compare_golds(self, other: 'Task'):
+        """Return the gold files that were added, removed or modified in the other
+        task, which is usually the same task in another branch. This compares the
+        git trees of the two gold directories, so both tasks have to be from
+        snapshots."""
+        if not (isinstance(self.path, utils.GitPath) and isinstance(other.path, utils.GitPath)):
+            raise TypeError('gold directories can only be compared in snapshots')
+        first = self._gold_directory.object
+        second = other._gold_directory.object
+        changes = Changes([], [], [])
+        if first is None and second is None:
+            return changes
+        # the empty tree stands in for a gold directory that does not exist
+        diff = diff_tree((first or second).repo,
+                         first.hexsha if first else EMPTY_TREE,
+                         second.hexsha if second else EMPTY_TREE)
+        for status, path in diff:
+            add_change(changes, status, path)
+        return changes
+
     def gold_content(self, gold_file):
         if gold_file is None:
             return ''
-        gold_path = Path(self._gold_directory / gold_file)
-        with open(gold_path) as fh:
-            return fh.read()
+        return render.file_text(self._gold_directory / gold_file)
 
     def compare_to_batch(self, batch: Batch):
         gold_files = set(self.gold_file_ids())
@@ -199,23 +842,30 @@ class Task(utils.FileSystemNode):
 
 class DataDrop(utils.FileSystemNode):
 
+    __slots__ = ('_file_names',)
+
     def __init__(self, path: Path):
         super().__init__(path)
-        self.files = list([f for f in self.path.iterdir()])
-        self.file_names = [f.name for f in self.files]
+        self._file_names = None
+
+    @property
+    def file_names(self):
+        if self._file_names is None:
+            self._file_names = tuple(f.name for f in self.path.iterdir())
+        return self._file_names
+
+    @property
+    def files(self):
+        return [self.path / name for name in self.file_names]
 
     def __len__(self):
-        return len(self.files)
+        return len(self.file_names)
 
     def __str__(self):
         return f'<{self.__class__.__name__} {self.name} files={len(self)}>'
 
     def file_content(self, filename: str):
-        path = Path(self.path / filename)
-        if path.suffix == '.json':
-            return json.dumps(json.load(path.open()), indent=2)
-        with path.open() as fh:
-            return fh.read()
+        return render.pretty_text(self.path / filename)
 
 
 def test_print_gold_files():
@@ -17,24 +17,30 @@ debug
     interface, with the debug option annotations and evaluations will be reloaded.
 
 no-checkout
-    Do not checkout a branch in the annotation/evaluation repository. This is
-    useful when experimenting with the code on changes in the repositories that
-    were not committed. Also, when your annotation/evaluation repository has 
-    local changes then checkout will fail.
+    Do not offer a choice of branches in the annotation repository and show the
+    working tree instead. This is useful when experimenting with the code on
+    changes in the repositories that were not committed. Branches are normally
+    read straight from the git objects, so the working tree is never touched.
+
+timing
+    Add a Performance page with timings of recent reruns and of the slowest
+    operations, these can also be downloaded as JSON.
 
 """
 
 import json
 import sys
 
-import pandas as pd
 import streamlit as st
 
 import config
 import model
 import utils
-from viewers.annotation_viewer import viewer as annotation_viewer
-from viewers.evaluation_viewer import viewer as evaluation_viewer
+import render
+import timing
+
+# The viewers and pandas are imported in the page that uses them, so the first
+# page is shown without waiting for modules that it does not need.
 
 
 # No debugging by default, this can be overwritten by handing an argument to the
@@ -47,14 +53,28 @@ CHECKOUT = True
 if 'no-checkout' in sys.argv[1:]:
     CHECKOUT = False
 
-if 'MODEL' not in st.session_state:
-    st.session_state['MODEL'] = model.Data(config.ANNOTATIONS,config.EVALUATIONS)
-MODEL = st.session_state['MODEL']
+TIMING = False
+if 'timing' in sys.argv[1:]:
+    TIMING = True
+
+RERUN = timing.start_rerun()
+
 
-# Without this, updates to Repository code will not be available on restarts.
-# TODO: this makes no sense, is this still needed?
-if DEBUG:
-    MODEL = st.session_state['MODEL']
+@st.cache_resource
+def load_model():
+    # One loader for the whole process, shared by all sessions. It loads the model
+    # in a background thread so pages render right away, and reruns and other
+    # sessions get this same loader so the repositories are only loaded once.
+    # Sessions that look at different branches get their own snapshots or
+    # worktrees from the model.
+    return model.Loader(config.ANNOTATIONS, config.EVALUATIONS)
+
+# In debug mode the model is rebuilt for each new session so updates to the
+# Repository code are picked up without restarting the server.
+if DEBUG and 'MODEL' not in st.session_state:
+    load_model.clear()
+    st.session_state['MODEL'] = True
+LOADER = load_model()
 
 
 
@@ -70,10 +90,20 @@ st.set_page_config(
 st.markdown(utils.style, unsafe_allow_html=True)
 
 
-dashboard = st.sidebar.radio(
-    'dashboard',
-    ['Overview', 'Annotation viewer', 'Evaluation viewer'],
-    label_visibility='hidden')
+pages = ['Overview', 'Annotation viewer', 'Evaluation viewer', 'Leaderboard', 'Search']
+if TIMING:
+    pages.append('Performance')
+
+dashboard = st.sidebar.radio('dashboard', pages, label_visibility='hidden', key='dashboard')
+RERUN.label = dashboard
+
+if st.sidebar.button('Refresh repositories'):
+    if LOADER.data is None:
+        st.sidebar.caption('The repositories are still being loaded')
+    else:
+        changed = LOADER.data.refresh()
+        st.sidebar.caption(f'{len(changed)} changes' if changed else 'No changes')
+        debug(f'Refreshed: {changed}')
 
 
 if dashboard == 'Overview':
@@ -97,8 +127,59 @@ if dashboard == 'Overview':
 
 elif dashboard == 'Annotation viewer':
 
-    annotation_viewer(MODEL, CHECKOUT)
+    from viewers.annotation_viewer import viewer as annotation_viewer
+    annotation_viewer(LOADER, CHECKOUT)
 
 elif dashboard == 'Evaluation viewer':
 
-    evaluation_viewer(MODEL)
+    from viewers.evaluation_viewer import viewer as evaluation_viewer
+    evaluation_viewer(LOADER)
+
+elif dashboard == 'Leaderboard':
+
+    from viewers.leaderboard_viewer import viewer as leaderboard_viewer
+    leaderboard_viewer(LOADER)
+
+elif dashboard == 'Search':
+
+    from viewers.search_viewer import viewer as search_viewer
+    search_viewer(LOADER, CHECKOUT)
+
+elif dashboard == 'Performance':
+
+    import pandas as pd
+
+    st.title('Performance')
+    reruns = timing.RECORDER.recent()
+    st.markdown('##### Recent reruns')
+    st.dataframe(
+        pd.DataFrame(
+            [[pd.Timestamp(r['start'], unit='s'), r['label'], r['seconds'],
+              r['bytes'], r['objects'], len(r['operations'])]
+             for r in reversed(reruns)],
+            columns=['start', 'page', 'seconds', 'bytes read', 'objects', 'operations']),
+        hide_index=True)
+    st.markdown('##### Slowest operations')
+    st.dataframe(
+        pd.DataFrame(
+            [[r['name'], r['calls'], r['max'], r['seconds'], r['bytes']]
+             for r in timing.RECORDER.slowest()],
+            columns=['operation', 'calls', 'max seconds', 'total seconds', 'bytes read']),
+        hide_index=True)
+    if LOADER.data is not None:
+        st.markdown('##### Memory')
+        st.dataframe(
+            pd.DataFrame(
+                [[name, size, utils.human_size(size)]
+                 for name, size in LOADER.data.memory_report().items()],
+                columns=['repository', 'bytes', 'size']),
+            hide_index=True)
+    st.markdown('##### Render cache')
+    st.dataframe(
+        pd.DataFrame([render.CACHE.stats()]), hide_index=True)
+    st.download_button(
+        'Download as JSON', timing.RECORDER.to_json(),
+        file_name='dashboard-timings.json', mime='application/json')
+
+
+timing.end_rerun()
@@ -0,0 +1,362 @@
+"""Benchmarks for the dashboard model
+
+Generates synthetic annotation and evaluation repositories and times the main
+operations on them: loading the repositories, switching branches, batch usage
+queries, task and batch comparisons and reading files for display. Startup of a
+new process from the cache is timed against config.STARTUP_BUDGET and there is
+a report of import times for the main modules. Results are written as JSON so
+they can be compared between versions of the code.
+
+Usage:
+
+$ python benchmark.py --tasks 20 --batches 10 --guids 200 --output results.json
+
+Use --help for all options. Repositories are generated in a temporary directory
+unless --directory is given, in which case they are kept and reused.
+
+"""
+
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+from pathlib import Path
+
+import config
+
+
+def generate_annotations(directory: Path, tasks: int, batches: int, guids: int,
+                         golds: int, drops: int, drop_files: int, branches: int):
+    """Create an annotation repository with tasks that each have gold files and
+    data drops, and batch files with GUIDs. The repository is a git repository
+    with a main branch and a number of other branches that each add gold files."""
+    from git import Repo
+    random.seed(42)
+    directory.mkdir(parents=True)
+    pool = [f'cpb-aacip-{i:08d}' for i in range(max(guids, golds) * 2)]
+    (directory / 'README.md').write_text('# Synthetic annotations\n')
+    (directory / 'batches').mkdir()
+    for b in range(batches):
+        with open(directory / 'batches' / f'batch-{b:03d}.txt', 'w') as fh:
+            fh.write(f'# {"-" * 60}\n# Synthetic batch {b}\n# {"-" * 60}\n')
+            fh.write('\n'.join(random.sample(pool, guids)) + '\n')
+    for t in range(tasks):
+        task = directory / f'task-{t:03d}'
+        (task / 'golds').mkdir(parents=True)
+        (task / 'readme.md').write_text(f'# Task {t}\n\nA synthetic task.\n')
+        (task / 'process.py').write_text('print("processing")\n')
+        for guid in random.sample(pool, golds):
+            (task / 'golds' / f'{guid}.csv').write_text('start,end,label\n0,10,x\n' * 20)
+        for d in range(drops):
+            drop = task / f'2401{d:02d}-drop'
+            drop.mkdir()
+            for guid in random.sample(pool, drop_files):
+                content = json.dumps({'guid': guid, 'frames': [1, 2, 3]})
+                (drop / f'{guid}.json').write_text(content)
+    repo = Repo.init(directory, initial_branch='main')
+    with repo.config_writer() as writer:
+        writer.set_value('user', 'name', 'benchmark')
+        writer.set_value('user', 'email', 'benchmark@example.com')
+    repo.git.add('-A')
+    repo.git.commit('-m', 'initial')
+    for b in range(branches):
+        repo.git.checkout('-b', f'branch-{b}', 'main')
+        golds_dir = directory / f'task-{b % tasks:03d}' / 'golds'
+        for guid in random.sample(pool, 10):
+            (golds_dir / f'{guid}-{b}.csv').write_text('start,end,label\n')
+        repo.git.add('-A')
+        repo.git.commit('-m', f'branch {b}')
+    repo.git.checkout('main')
+
+
+def mmif_content(guid: str, size: int):
+    """Return a MMIF string of roughly the given size."""
+    annotation_count = max(1, size // 150)
+    annotations = [
+        {'@type': 'http://mmif.clams.ai/vocabulary/TimeFrame/v5',
+         'properties': {'id': f'tf_{i}', 'start': i * 1000, 'end': i * 1000 + 500,
+                        'frameType': 'slate'}}
+        for i in range(annotation_count)]
+    return json.dumps({
+        'metadata': {'mmif': 'http://mmif.clams.ai/1.0.4'},
+        'documents': [
+            {'@type': 'http://mmif.clams.ai/vocabulary/VideoDocument/v1',
+             'properties': {'id': 'd1', 'mime': 'video', 'location': f'file:///{guid}.mp4'}}],
+        'views': [
+            {'id': 'v_0',
+             'metadata': {'app': 'http://apps.clams.ai/swt-detection/v5.0',
+                          'timestamp': '2024-01-01T00:00:00', 'contains': {}},
+             'annotations': annotations}]})
+
+
+def generate_evaluations(directory: Path, evaluations: int, predictions: int,
+                         files: int, size: int, batches: int):
+    """Create an evaluation repository with evaluation directories that each have
+    prediction directories with MMIF files and a report for each prediction."""
+    random.seed(43)
+    directory.mkdir(parents=True)
+    for e in range(evaluations):
+        evaluation = directory / f'eval-{e:03d}-eval'
+        evaluation.mkdir()
+        (evaluation / 'README.md').write_text(f'# Evaluation {e}\n')
+        (evaluation / 'evaluate.py').write_text('print("evaluating")\n')
+        for p in range(predictions):
+            batch = f'batch-{random.randrange(batches):03d}'
+            preds = evaluation / f'preds@app-{p}@{batch}'
+            preds.mkdir()
+            for f in range(files):
+                guid = f'cpb-aacip-{f:08d}'
+                (preds / f'{guid}.mmif').write_text(mmif_content(guid, size))
+            report = evaluation / f'report-app-{p}@tool@{batch}.md'
+            report.write_text(
+                '| label | P | R | F1 |\n|---|---|---|---|\n| slate | 0.9 | 0.8 | 0.85 |\n')
+
+
+def timed(results: dict, name: str, function, repeat: int = 3):
+    """Run a function a number of times and add the timings to the results. The
+    result of the last run is returned."""
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        value = function()
+        seconds.append(time.perf_counter() - start)
+    results[name] = {
+        'seconds': seconds,
+        'min': min(seconds),
+        'median': statistics.median(seconds) }
+    print(f'{name:40s} {min(seconds):10.4f}s', file=sys.stderr)
+    return value
+
+
+# Modules timed by the import report, each one in a fresh interpreter.
+MODULES = ['config', 'utils', 'annotation', 'evaluation', 'store', 'model', 'git',
+           'pandas', 'streamlit', 'viewers.annotation_viewer',
+           'viewers.evaluation_viewer', 'viewers.leaderboard_viewer']
+
+STARTUP = '''
+import sys, time
+start = time.perf_counter()
+import config
+config.CACHE = sys.argv[1]
+import model
+data = model.Data(sys.argv[2], sys.argv[3])
+print(time.perf_counter() - start, 'git' in sys.modules)
+'''
+
+
+def python(*arguments):
+    """Run a fresh interpreter in the code directory and return its output."""
+    return subprocess.run(
+        [sys.executable, *arguments], capture_output=True, text=True, check=True,
+        cwd=Path(__file__).parent).stdout
+
+
+def import_times():
+    """Return the time it takes to import each module and whether importing it
+    also imports GitPython."""
+    report = {}
+    for module in MODULES:
+        code = ('import sys, time; start = time.perf_counter(); '
+                f'import {module}; '
+                "print(time.perf_counter() - start, 'git' in sys.modules)")
+        try:
+            seconds, git = python('-c', code).split()
+        except subprocess.CalledProcessError:
+            continue
+        report[module] = { 'seconds': float(seconds), 'imports git': git == 'True' }
+        print(f'import {module:34s} {float(seconds):10.4f}s', file=sys.stderr)
+    return report
+
+
+def startup(directory: Path):
+    """Time a new process that loads the model from the cache, which is what
+    happens when the dashboard is restarted."""
+    seconds, git = python(
+        '-c', STARTUP, config.CACHE, str(directory / 'annotations'),
+        str(directory / 'evaluations')).split()
+    print(f'{"startup.warm":40s} {float(seconds):10.4f}s', file=sys.stderr)
+    return {
+        'seconds': float(seconds),
+        'imports git': git == 'True',
+        'budget': config.STARTUP_BUDGET,
+        'within budget': float(seconds) <= config.STARTUP_BUDGET }
+
+
+def run(directory: Path):
+    import annotation
+    import evaluation
+    import model
+    import mmif
+    import render
+    import search
+    import textfile
+    import utils
+    annotations_dir = directory / 'annotations'
+    evaluations_dir = directory / 'evaluations'
+    results = {}
+    def cold_load():
+        # a fresh cache directory means there is no manifest to load from
+        config.CACHE = tempfile.mkdtemp(dir=directory)
+        return annotation.Repository(annotations_dir)
+    timed(results, 'annotations.load.cold', cold_load)
+    repository = timed(results, 'annotations.load.warm',
+                       lambda: annotation.Repository(annotations_dir))
+    timed(results, 'annotations.refresh', repository.refresh)
+    warm_start = startup(directory)
+    branch_names = [b for b in repository.branch_names if b != 'main']
+    timed(results, 'annotations.checkout',
+          lambda: [repository.checkout(b) for b in branch_names + ['main']], repeat=1)
+    timed(results, 'annotations.snapshot.first',
+          lambda: [repository.snapshot(b) for b in branch_names], repeat=1)
+    timed(results, 'annotations.snapshot.memoized',
+          lambda: [repository.snapshot(b) for b in branch_names])
+    timed(results, 'annotations.compare',
+          lambda: [repository.compare('main', b) for b in branch_names])
+    def history_first():
+        repository._history = None
+        config.CACHE = tempfile.mkdtemp(dir=directory)
+        return repository.history('main')
+    timed(results, 'history.first', history_first, repeat=1)
+    timed(results, 'history.restart',
+          lambda: annotation.Repository(annotations_dir).history('main'), repeat=1)
+    timed(results, 'history.cached', lambda: repository.history('main'))
+    timed(results, 'annotations.gold_files',
+          lambda: [len(task) for task in annotation.Repository(annotations_dir).tasks])
+    timed(results, 'compare_to_batch.all',
+          lambda: [task.compare_to_batch(batch)
+                   for task in repository.tasks for batch in repository.batches])
+    def overlaps():
+        repository._overlaps = None
+        return repository.overlaps
+    timed(results, 'overlaps.build', overlaps)
+    timed(results, 'overlaps.lookup.all',
+          lambda: [repository.comparison(task, batch)
+                   for task in repository.task_names for batch in repository.batch_names])
+    timed(results, 'evaluations.load', lambda: evaluation.Repository(evaluations_dir))
+    data = timed(results, 'data.load',
+                 lambda: model.Data(annotations_dir, evaluations_dir), repeat=1)
+    timed(results, 'data.batch_usage',
+          lambda: [(data.batch_usage_in_system_predictions(b),
+                    data.batch_usage_in_system_reports(b))
+                   for b in data.annotations.batch_names])
+    def coverage():
+        data._coverage = model.Coverage()
+        return data.coverage()
+    timed(results, 'data.coverage', coverage)
+    timed(results, 'store.coverage',
+          lambda: [(data.store.tasks_covering_batch(b), data.store.prediction_coverage(b))
+                   for b in data.annotations.batch_names])
+    def search_index():
+        data._search = search.SearchIndex()
+        data._search._loaded = True
+        data._search.update(data.annotations, data.evaluations)
+    timed(results, 'search.index', search_index, repeat=1)
+    timed(results, 'search.update',
+          lambda: data._search.update(data.annotations, data.evaluations))
+    data._search_current = True
+    timed(results, 'search.query',
+          lambda: [data.search(query) for query in ('batch', 'gold', 'label f1')])
+    names = tuple(f'cpb-aacip-{i:08d}.json' for i in range(100000))
+    timed(results, 'picker.listing', lambda: utils.FileListing(names))
+    listing = utils.get_listing(names)
+    timed(results, 'picker.page',
+          lambda: [listing.matches(f'cpb-aacip-{i:04d}', 0, config.PICKER_PAGE_SIZE)
+                   for i in range(100)])
+    prediction = data.evaluations.evaluations[0].predictions
+    prediction = sorted(prediction)[0]
+    path = prediction.path / prediction.file_names()[0]
+    timed(results, 'display.mmif.full',
+          lambda: json.dumps(json.loads(path.read_text()), indent=2))
+    timed(results, 'display.mmif.full.cached', lambda: render.pretty_text(path))
+    timed(results, 'display.mmif.index', lambda: mmif.MmifIndex(path))
+    mmif_file = mmif.MmifFile(path)
+    timed(results, 'display.mmif.page',
+          lambda: json.dumps(mmif_file.annotations(0, 0, config.PAGE_SIZE), indent=2))
+    task = data.annotations.tasks[0]
+    gold_file = task.gold_file_names[0]
+    def gold_uncached():
+        render.CACHE.clear()
+        return task.gold_content(gold_file)
+    timed(results, 'display.gold', gold_uncached)
+    timed(results, 'display.gold.cached', lambda: task.gold_content(gold_file))
+    gold_path = task.gold_directory / gold_file
+    timed(results, 'display.lines.index', lambda: textfile.LineIndex(gold_path))
+    paged_file = textfile.PagedFile(gold_path, pretty=True)
+    def page_uncached():
+        render.CACHE.clear()
+        return paged_file.page(0)
+    timed(results, 'display.lines.page', page_uncached)
+    timed(results, 'display.lines.page.cached', lambda: paged_file.page(0))
+    return results, warm_start, data.memory_report()
+
+
+def code_version():
+    try:
+        return subprocess.run(
+            ['git', 'describe', '--always', '--dirty'], capture_output=True,
+            text=True, cwd=Path(__file__).parent).stdout.strip()
+    except OSError:
+        return None
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Benchmarks for the CLAMS dashboard')
+    parser.add_argument('--directory', help='directory for the generated repositories')
+    parser.add_argument('--output', help='file to write JSON results to (default: stdout)')
+    parser.add_argument('--tasks', type=int, default=10)
+    parser.add_argument('--batches', type=int, default=10)
+    parser.add_argument('--guids', type=int, default=100, help='GUIDs in each batch')
+    parser.add_argument('--golds', type=int, default=100, help='gold files in each task')
+    parser.add_argument('--drops', type=int, default=2, help='data drops in each task')
+    parser.add_argument('--drop-files', type=int, default=20, help='files in each data drop')
+    parser.add_argument('--branches', type=int, default=3)
+    parser.add_argument('--evaluations', type=int, default=5)
+    parser.add_argument('--predictions', type=int, default=2,
+                        help='prediction batches in each evaluation')
+    parser.add_argument('--mmif-files', type=int, default=20,
+                        help='MMIF files in each prediction batch')
+    parser.add_argument('--mmif-size', type=int, default=100000,
+                        help='size of MMIF files in bytes')
+    return parser.parse_args()
+
+
+def main():
+    options = parse_arguments()
+    if options.directory:
+        directory = Path(options.directory).resolve()
+    else:
+        directory = Path(tempfile.mkdtemp(prefix='dashboard-benchmark-'))
+    if not (directory / 'annotations').exists():
+        generate_annotations(
+            directory / 'annotations', options.tasks, options.batches, options.guids,
+            options.golds, options.drops, options.drop_files, options.branches)
+        generate_evaluations(
+            directory / 'evaluations', options.evaluations, options.predictions,
+            options.mmif_files, options.mmif_size, options.batches)
+    timings, warm_start, memory = run(directory)
+    results = {
+        'version': code_version(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'parameters': {
+            k: v for k, v in vars(options).items() if k not in ('directory', 'output') },
+        'results': timings,
+        'startup': warm_start,
+        'imports': import_times(),
+        'memory': memory }
+    output = json.dumps(results, indent=2)
+    if options.output:
+        Path(options.output).write_text(output)
+    else:
+        print(output)
+
+
+
+if __name__ == '__main__':
+
+    main()
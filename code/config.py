@@ -5,6 +5,61 @@ SOURCES = '../../wgbh-collaboration/'
 ANNOTATIONS = '../../aapb-annotations/'
 EVALUATIONS = '../../aapb-evaluations/'
 
-# Maximum size of a file, if it is larger, the user will be prompted whether it
-# should be displayed
-MAX_FILESIZE = 100000
+# Number of documents or annotations shown at once in the MMIF viewer
+PAGE_SIZE = 20
+
+# Number of lines shown at once when viewing gold files, data drop files and batches
+FILE_PAGE_SIZE = 200
+
+# Maximum number of bytes shown on one page of a file, a page with very long lines
+# is cut off
+FILE_PAGE_BYTES = 1024 * 1024
+
+# Number of file names shown at once in a file picker, longer listings get a filter
+# on the start of the name and pages
+PICKER_PAGE_SIZE = 100
+
+# Number of sorted file listings kept for the file pickers
+LISTING_CACHE_SIZE = 256
+
+# Number of branch histories kept as data frames for the history tab
+HISTORY_CACHE_SIZE = 8
+
+# Number of branch comparisons kept for the compare tab
+COMPARISON_CACHE_SIZE = 16
+
+# Bytes of rendered file content kept in memory, this is file content and pages of
+# files as they are shown, with JSON pretty-printed
+RENDER_CACHE_SIZE = 64 * 1024 * 1024
+
+# Bytes of line indexes kept in memory, for files from git this includes the
+# content of the file
+LINE_INDEX_CACHE_SIZE = 128 * 1024 * 1024
+
+# Number of threads used to read the repositories, mostly helps when the disk is
+# slow or on a network
+LOAD_THREADS = 8
+
+# Number of processes used to summarize MMIF files, None means all processors
+WORKERS = None
+
+# Directory for caches that survive restarts of the dashboard, for now this has
+# manifests of the annotation repository indexed on commit.
+CACHE = '.cache'
+
+# SQLite database with the tasks, batches and evaluations, None means a database
+# in the cache directory named after the annotation and evaluation repositories
+DATABASE = None
+
+# By default branches of the annotation repository are read from the git objects,
+# set this to True to give each branch its own git worktree instead, the pool size
+# is the maximum number of worktrees kept around.
+WORKTREES = False
+WORKTREE_POOL_SIZE = 4
+
+# Maximum number of files listed for a directory in the gold directory tree
+TREE_FILES = 100
+
+# Seconds allowed for a process to import the model and load both repositories
+# from the cache, the benchmark reports whether startup stays within this budget
+STARTUP_BUDGET = 2.0
@@ -1,18 +1,29 @@
 
+import re
+import hashlib
+import threading
 from pathlib import Path
+
 import config
 import utils
+import mmif
+import timing
 
 
 class Repository:
 
     """Class to give access to data in the evaluation repository."""
 
+    @timing.timed('evaluations.load')
     def __init__(self, directory: str):
         self.path = Path(directory) 
-        self.evaluations_idx = { p.stem: Evaluation(p) for p in self.eval_directories() }
-        self.evaluations = sorted(self.evaluations_idx.values())
-        self.evaluation_names = sorted(self.evaluations_idx.keys())
+        directories = self.eval_directories()
+        evaluations = utils.parallel_map(Evaluation, directories)
+        self.evaluations_idx = { p.stem: e for p, e in zip(directories, evaluations) }
+        self.signature = utils.signature(self.path)
+        self.update_lists()
+        self._leaderboard = Leaderboard()
+        timing.add_objects(len(self.evaluations_idx))
 
     def __str__(self):
         return f'<{self.__class__.__name__} "{self.path.name}">'
@@ -21,26 +32,105 @@ class Repository:
         return self.evaluations[index]
 
     def eval_directories(self):
-        return [ p for p in self.path.iterdir() if p.name.endswith('eval') and p.is_dir()]
+        return [ p for p, is_dir in utils.scan_directory(self.path)
+                 if is_dir and p.name.endswith('eval') ]
 
     def evaluation(self, name: str):
         return self.evaluations_idx.get(name)
 
+    def update_lists(self):
+        self.evaluations = sorted(self.evaluations_idx.values())
+        self.evaluation_names = sorted(self.evaluations_idx.keys())
+
+    def leaderboard(self):
+        """Return rows with all metrics from all reports, see Leaderboard. Reports
+        are parsed when this is first called and after that only reports that
+        changed since the last call are parsed again."""
+        self._leaderboard.update(self)
+        return self._leaderboard.rows()
+
+    @timing.timed('evaluations.refresh')
+    def refresh(self):
+        """Pick up changes in the repository without rebuilding everything. The
+        list of evaluation directories is only read again if the modification time
+        of the repository changed and only those evaluations, prediction batches
+        and reports whose modification time or size changed are rebuilt. Returns
+        the names of what was rebuilt or removed, as "evaluation/name" strings."""
+        changed = []
+        evaluations_idx = dict(self.evaluations_idx)
+        signature = utils.signature(self.path)
+        if signature != self.signature:
+            self.signature = signature
+            directories = { p.stem: p for p in self.eval_directories() }
+            for name in set(evaluations_idx) - set(directories):
+                del evaluations_idx[name]
+                changed.append(name)
+            for name in set(directories) - set(evaluations_idx):
+                evaluations_idx[name] = Evaluation(directories[name])
+                changed.append(name)
+        names = list(evaluations_idx)
+        refreshed = utils.parallel_map(Evaluation.refresh, evaluations_idx.values())
+        for name, items in zip(names, refreshed):
+            changed.extend(f'{name}/{item}' for item in items)
+        self.evaluations_idx = evaluations_idx
+        self.update_lists()
+        return changed
+
 
 class Evaluation(utils.FileSystemNode):
 
+    __slots__ = ('readme_file', 'signature', '_scripts', '_predictions', 'reports')
+
     def __init__(self, path: Path):
         super().__init__(path)
         self.readme_file = Path(path / 'README.md')
-        self.readme = utils.read_file(self.readme_file)
-        self._scripts = list(path.glob('*.py'))
         self._predictions = {}
         self.reports = {}
-        for p in self.path.iterdir():
-            if p.is_dir() and p.name.startswith('preds@'):
-                self._predictions[p.name] = PredictionBatch(p)
-            elif p.is_file() and p.name.startswith('report-'):
-                self.reports[p.name] = Report(p)
+        self.scan()
+
+    def scan(self):
+        """Read the directory and create predictions and reports, but only for those
+        that were not created before or that changed since they were created."""
+        changed = []
+        self.signature = utils.signature(self.path)
+        self._scripts = list(self.path.glob('*.py'))
+        predictions = {}
+        reports = {}
+        for p, is_dir in utils.scan_directory(self.path):
+            if is_dir and p.name.startswith('preds@'):
+                predictions[p.name] = self._predictions.get(p.name)
+                if predictions[p.name] is None or predictions[p.name].changed():
+                    predictions[p.name] = PredictionBatch(p)
+                    changed.append(p.name)
+            elif not is_dir and p.name.startswith('report-'):
+                reports[p.name] = self.reports.get(p.name)
+                if reports[p.name] is None or reports[p.name].changed():
+                    reports[p.name] = Report(p)
+                    changed.append(p.name)
+        changed.extend(set(self._predictions) - set(predictions))
+        changed.extend(set(self.reports) - set(reports))
+        self._predictions = predictions
+        self.reports = reports
+        return changed
+
+    def refresh(self):
+        """Rebuild whatever changed since the evaluation was loaded and return the
+        names of changed predictions and reports."""
+        # the readme is not kept so there is nothing to do for it
+        changed = []
+        if self.signature != utils.signature(self.path):
+            # the directory itself changed, so something was added or removed
+            changed.extend(self.scan())
+        else:
+            for name, prediction in self._predictions.items():
+                if prediction.changed():
+                    self._predictions[name] = PredictionBatch(prediction.path)
+                    changed.append(name)
+            for name, report in self.reports.items():
+                if report.changed():
+                    self.reports[name] = Report(report.path)
+                    changed.append(name)
+        return changed
 
     def __str__(self):
         return f'<{self.__class__.__name__} "{self.path.stem}">'
@@ -51,6 +141,10 @@ class Evaluation(utils.FileSystemNode):
     def __eq__(self, other):
         return self.path.stem == other.path.stem
 
+    @property
+    def readme(self):
+        return utils.read_file(self.readme_file)
+
     def prediction(self, name: str):
         return self._predictions.get(name)
 
@@ -81,35 +175,224 @@ class PredictionBatch(utils.FileSystemNode):
     """Class to wrap a directory with predictions. Each prediction is a MMIF file
     with processing results."""
 
+    __slots__ = ('prediction_name', 'prediction_batch', '_file_names', 'signature')
+
     def __init__(self, path: Path):
         super().__init__(path)
         if len(self.name.split('@')) < 3:
             print("WARNING - missing component in name:", self.path)
         self.prediction_name = '@'.join(self.name.split('@')[1:-1])
         self.prediction_batch = self.name.split('@')[-1]
-        self.readme = None
-        self.files = {}
-        readme_path = self.path / 'README.md'
-        if readme_path.is_file():
-            self.readme = utils.read_file(readme_path)
-        for p in self.path.iterdir():
-            if p.is_file() and p.name.endswith('.mmif'):
-                self.files[p.name] = p
-        
+        # the list of MMIF files is read when first needed, the readme each time
+        self._file_names = None
+        self.signature = utils.signature(path)
+
     def __str__(self):
         return f'<{self.__class__.__name__} {self.prediction_name} {self.prediction_batch}>'
 
+    @property
+    def readme(self):
+        readme_path = self.path / 'README.md'
+        if readme_path.is_file():
+            return utils.read_file(readme_path)
+        return None
+
+    @property
+    def files(self):
+        return { name: self.path / name for name in self.file_names() }
+
     def file_names(self):
-        return sorted(self.files)
+        if self._file_names is None:
+            self._file_names = tuple(
+                p.name for p, is_dir in utils.scan_directory(self.path)
+                if not is_dir and p.name.endswith('.mmif'))
+        return self._file_names
+
+    def guids(self):
+        """Return the GUIDs of the MMIF files, which are the file names without the
+        extension."""
+        return [Path(name).stem for name in self.file_names()]
+
+    def summary(self):
+        """Return a list of summaries for all MMIF files, with the file name added
+        to each summary. See mmif.summarize() for what is in a summary."""
+        file_names = self.file_names()
+        summaries = mmif.summarize_files(self.path, file_names)
+        return [dict(summary, file=name) for name, summary in zip(file_names, summaries)]
+
+    def changed(self):
+        """Return True if files were added to or removed from the directory since
+        this object was created."""
+        return self.signature != utils.signature(self.path)
 
 
 class Report(utils.FileSystemNode):
 
+    __slots__ = ('report_tool', 'report_batch', 'prediction_name', 'signature')
+
     def __init__(self, path: Path):
         super().__init__(path)
         self.report_tool = self.name.split('@')[-2]
         self.report_batch = self.path.stem.split('@')[-1]
-        self.content = utils.read_file(self.path)
+        # the name is "report-<prediction name>@<tool>@<batch>.md"
+        prediction_name = '@'.join(self.path.stem.split('@')[:-2])
+        self.prediction_name = prediction_name[len('report-'):]
+        self.signature = utils.signature(path)
+
+    @property
+    def content(self):
+        return utils.read_file(self.path)
+
+    def changed(self):
+        return self.signature != utils.signature(self.path)
+
+    def tables(self):
+        """Return the tables in the report, see parse_tables()."""
+        return parsed_tables(self.content)
+
+    def metrics(self):
+        """Return rows with the table title, the row label, the metric name and
+        the value for each number in the tables of the report."""
+        return [[table['title'], label, metric, value]
+                for table in self.tables()
+                for label, metric, value in table_metrics(table)]
+
+
+class Leaderboard:
+
+    """Metrics from all reports in the repository, with for each number the
+    evaluation, prediction name, report tool and batch of the report it is from.
+    Metrics of a report are kept with the signature the report had, and when the
+    leaderboard is updated only reports with another signature are parsed."""
+
+    COLUMNS = ['evaluation', 'prediction', 'tool', 'batch', 'table', 'label', 'metric', 'value']
+
+    def __init__(self):
+        # report keys ("evaluation/report name") to signatures and rows
+        self._reports = {}
+
+    def __len__(self):
+        return len(self._reports)
+
+    @timing.timed('evaluations.leaderboard')
+    def update(self, repository: Repository):
+        """Parse reports that were added or changed and drop those that are gone,
+        returns the keys of what was parsed or dropped."""
+        reports = {}
+        changed = []
+        for evaluation in repository.evaluations:
+            for report in evaluation.get_reports():
+                key = f'{evaluation.name}/{report.name}'
+                cached = self._reports.get(key)
+                if cached is not None and cached[0] == report.signature:
+                    reports[key] = cached
+                    continue
+                prefix = [evaluation.name, report.prediction_name,
+                          report.report_tool, report.report_batch]
+                reports[key] = (report.signature, [prefix + row for row in report.metrics()])
+                changed.append(key)
+        changed.extend(set(self._reports) - set(reports))
+        self._reports = reports
+        if changed:
+            save_parsed_tables()
+        return changed
+
+    def rows(self):
+        return [row for _, rows in self._reports.values() for row in rows]
+
+
+# A separator line under the header of a markdown table, like "|---|:---:|"
+TABLE_SEPARATOR = re.compile(r'^\|?\s*:?-+:?\s*(\|\s*:?-+:?\s*)*\|?$')
+
+# Tables parsed from reports, indexed on the SHA1 of the report content and saved
+# in the cache directory, None until first used.
+_parsed = None
+_parsed_changed = False
+_parsed_lock = threading.Lock()
+
+
+def parse_tables(text: str):
+    """Return the tables in a markdown text, each as a dictionary with the header,
+    the rows and the title, which is the text of the last heading before the
+    table."""
+    tables = []
+    title = ''
+    lines = [line.strip() for line in text.splitlines()]
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        if line.startswith('#'):
+            title = line.lstrip('#').strip()
+        elif ('|' in line and i + 1 < len(lines)
+              and TABLE_SEPARATOR.match(lines[i + 1]) and '|' in lines[i + 1]):
+            header = split_row(line)
+            rows = []
+            i += 2
+            while i < len(lines) and '|' in lines[i]:
+                rows.append(split_row(lines[i]))
+                i += 1
+            tables.append({ 'title': title, 'header': header, 'rows': rows })
+            continue
+        i += 1
+    return tables
+
+
+def split_row(line: str):
+    line = line.strip()
+    if line.startswith('|'):
+        line = line[1:]
+    if line.endswith('|'):
+        line = line[:-1]
+    return [cell.strip() for cell in line.split('|')]
+
+
+def table_metrics(table: dict):
+    """Return (label, metric, value) triples for all cells in a table that have a
+    number, where the label is the first cell of the row and the metric is the
+    column header."""
+    metrics = []
+    header = table['header']
+    for row in table['rows']:
+        for metric, cell in zip(header[1:], row[1:]):
+            value = to_number(cell)
+            if value is not None:
+                metrics.append((row[0], metric, value))
+    return metrics
+
+
+def to_number(cell: str):
+    cell = cell.strip().strip('*')
+    try:
+        if cell.endswith('%'):
+            return float(cell[:-1]) / 100
+        return float(cell)
+    except ValueError:
+        return None
+
+
+def parsed_tables(content: str):
+    """Return the tables in report content, only parsing it if content with the
+    same hash was not parsed before."""
+    global _parsed, _parsed_changed
+    digest = hashlib.sha1(content.encode('utf8')).hexdigest()
+    with _parsed_lock:
+        if _parsed is None:
+            _parsed = utils.read_cache('report-tables') or {}
+        tables = _parsed.get(digest)
+    if tables is None:
+        tables = parse_tables(content)
+        with _parsed_lock:
+            _parsed[digest] = tables
+            _parsed_changed = True
+    return tables
+
+
+def save_parsed_tables():
+    global _parsed_changed
+    with _parsed_lock:
+        if _parsed_changed:
+            utils.write_cache('report-tables', _parsed)
+            _parsed_changed = False
 
 
 
@@ -0,0 +1,208 @@
+"""History of the annotation repository
+
+For each commit on the first-parent history of a branch this has the number of
+gold files in each task, the size of each batch and the data drops that arrived.
+Nothing is checked out. The changes a commit made are read from one git-diff-tree
+run for all commits, and only batch files that changed are read from git.
+
+What a commit changed does not depend on the branch it is on, so the changes are
+cached on the commit SHA and saved in the cache directory. After the first run
+only commits that were not seen before are looked at, and a timeline is made by
+adding up the changes of all commits on a branch.
+
+Git is run directly instead of through GitPython, since everything here can be
+done with a few git processes that read from and write to pipes.
+
+"""
+
+import re
+import threading
+import subprocess
+from pathlib import Path
+from collections import namedtuple
+
+import utils
+import timing
+import annotation
+
+
+# Version of the saved changes, changes saved with another version are not used.
+HISTORY_VERSION = 1
+
+# A data drop is a directory in a task whose name starts with a date.
+DATA_DROP = re.compile(r'\d{6}')
+
+# One step of a timeline, with the gold file counts and batch sizes after the
+# commit and the data drops ("task/drop") that got their first files in it.
+Step = namedtuple('Step', ['commit', 'time', 'subject', 'golds', 'batches', 'arrivals'])
+
+
+class History:
+
+    """Changes made by each commit in the annotation repository, with timelines of
+    branches made from them. Shared by all sessions, updates go through a lock."""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.name = self.path.resolve().name
+        # commit SHAs to [time, subject, gold changes, batch sizes, data drop changes]
+        self._changes = None
+        # timelines indexed on the SHA of the commit they end with
+        self._timelines = {}
+        self._lock = threading.Lock()
+
+    def __str__(self):
+        commits = 0 if self._changes is None else len(self._changes)
+        return f'<{self.__class__.__name__} {self.name} commits={commits}>'
+
+    def git(self, *arguments, input: bytes = None):
+        result = subprocess.run(
+            ['git', *arguments], cwd=self.path, input=input,
+            capture_output=True, check=True)
+        timing.add_bytes(len(result.stdout))
+        return result.stdout
+
+    @timing.timed('history.timeline')
+    def timeline(self, branch: str):
+        """Return the steps for all commits on the first-parent history of a branch,
+        oldest first."""
+        with self._lock:
+            if self._changes is None:
+                self.load()
+            log = self.git('log', '--first-parent', '--reverse',
+                           '--format=%H%x09%P%x09%ct%x09%s', branch, '--')
+            commits = [line.split('\t', 3) for line in log.decode('utf8').splitlines()]
+            if not commits:
+                return []
+            head = commits[-1][0]
+            if head not in self._timelines:
+                new = [commit for commit in commits if commit[0] not in self._changes]
+                if new:
+                    self.add_changes(new)
+                    self.save()
+                self._timelines[head] = self.steps(commits)
+            return self._timelines[head]
+
+    def add_changes(self, commits: list):
+        """Find the changes made by commits, which are lists with the SHA, the SHAs
+        of the parents, the time and the subject, compared to their first parent."""
+        # a line with a commit and one parent compares the commit to that parent,
+        # this also gives merge commits the changes that were merged in
+        lines = ''.join(f'{sha} {parents.split(" ")[0]}'.strip() + '\n'
+                        for sha, parents, _, _ in commits)
+        output = self.git('diff-tree', '--stdin', '-r', '--root', '--no-renames', '-z',
+                          input=lines.encode('utf8'))
+        changes = {
+            sha: [int(time), subject, {}, {}, {}] for sha, _, time, subject in commits }
+        batch_blobs = {}
+        fields = output.decode('utf8', errors='replace').split('\0')
+        current = None
+        i = 0
+        while i < len(fields):
+            field = fields[i].strip()
+            if field.startswith(':'):
+                # ":<mode> <mode> <sha> <sha> <status>" followed by the path
+                _, _, _, blob, status = field[1:].split()
+                self.add_change(changes, current, status[0], fields[i + 1], blob, batch_blobs)
+                i += 2
+                continue
+            if field in changes:
+                current = field
+            i += 1
+        sizes = self.batch_sizes(set(batch_blobs.values()))
+        for (sha, name), blob in batch_blobs.items():
+            changes[sha][3][name] = sizes.get(blob)
+        self._changes.update(changes)
+        timing.add_objects(len(commits))
+
+    @staticmethod
+    def add_change(changes: dict, sha: str, status: str, path: str, blob: str,
+                   batch_blobs: dict):
+        """Add one changed file to the changes of a commit. Only additions and
+        removals of gold files and data drop files change counts, a batch that was
+        added or modified gets the blob of the new batch file to read its size."""
+        parts = path.split('/')
+        step = { 'A': 1, 'D': -1 }.get(status, 0)
+        golds, batches, drops = changes[sha][2:]
+        if parts[0] == 'batches' and len(parts) == 2:
+            name = Path(parts[1]).stem
+            if status == 'D':
+                batches[name] = None
+            else:
+                batch_blobs[(sha, name)] = blob
+        elif step and len(parts) in (3, 4) and parts[1] == 'golds':
+            golds[parts[0]] = golds.get(parts[0], 0) + step
+        elif step and len(parts) > 2 and DATA_DROP.match(parts[1]):
+            drop = f'{parts[0]}/{parts[1]}'
+            drops[drop] = drops.get(drop, 0) + step
+
+    def batch_sizes(self, blobs: set):
+        """Return the number of GUIDs in batch files, indexed on the SHA of the blob."""
+        if not blobs:
+            return {}
+        blobs = sorted(blobs)
+        output = self.git(
+            'cat-file', '--batch', input=''.join(f'{blob}\n' for blob in blobs).encode())
+        sizes = {}
+        position = 0
+        for blob in blobs:
+            end = output.index(b'\n', position)
+            header = output[position:end].split()
+            position = end + 1
+            if len(header) < 3:
+                continue
+            size = int(header[2])
+            content = output[position:position + size].decode('utf8', errors='replace')
+            sizes[blob] = len(annotation.Batch.read_guids(content))
+            position += size + 1
+        return sizes
+
+    def steps(self, commits: list):
+        golds = {}
+        batches = {}
+        drops = {}
+        steps = []
+        for sha, _, _, _ in commits:
+            time, subject, gold_changes, batch_sizes, drop_changes = self._changes[sha]
+            if gold_changes:
+                golds = dict(golds)
+                for task, count in gold_changes.items():
+                    golds[task] = golds.get(task, 0) + count
+            if batch_sizes:
+                batches = dict(batches)
+                for name, size in batch_sizes.items():
+                    if size is None:
+                        batches.pop(name, None)
+                    else:
+                        batches[name] = size
+            arrivals = []
+            for drop, count in drop_changes.items():
+                if drops.get(drop, 0) <= 0 < drops.get(drop, 0) + count:
+                    arrivals.append(drop)
+                drops[drop] = drops.get(drop, 0) + count
+            steps.append(Step(sha, time, subject, golds, batches, arrivals))
+        return steps
+
+    def load(self):
+        saved = utils.read_cache(f'history-{self.name}')
+        if saved is not None and saved.get('version') == HISTORY_VERSION:
+            self._changes = saved['changes']
+        else:
+            self._changes = {}
+
+    def save(self):
+        utils.write_cache(
+            f'history-{self.name}', { 'version': HISTORY_VERSION, 'changes': self._changes })
+
+
+
+if __name__ == '__main__':
+
+    import sys
+    import config
+
+    history = History(config.ANNOTATIONS)
+    steps = history.timeline(sys.argv[1] if len(sys.argv) > 1 else 'main')
+    print(history)
+    for step in steps[-10:]:
+        print(step.commit[:8], step.time, step.subject[:40], step.golds, step.arrivals)
@@ -0,0 +1,420 @@
+"""Streaming access to MMIF files
+
+MMIF files can be hundreds of megabytes, which is too much to load, parse and
+print in one go. The MmifFile class instead scans the file once and keeps the
+byte offsets of the top-level metadata, the documents, the views and the
+annotations in each view. After that any document, view or page of annotations
+can be read and parsed on its own.
+
+"""
+
+import os
+import re
+import json
+import mmap
+import hashlib
+import threading
+from array import array
+from pathlib import Path
+from collections import OrderedDict, Counter
+from concurrent.futures import ProcessPoolExecutor
+
+import config
+import utils
+import timing
+
+
+# A token is a string (which may have escaped characters) or a structural
+# character, numbers and constants are not needed to find offsets.
+TOKENS = re.compile(rb'"[^"\\]*(?:\\.[^"\\]*)*"|[{}\[\],:]')
+WHITESPACE = re.compile(rb'[ \t\n\r]*')
+
+# Size in bytes of the text window handed to the JSON parser when finding the
+# ends of documents and annotations.
+WINDOW_SIZE = 1 << 20
+
+DECODER = json.JSONDecoder()
+
+# Number of file indexes kept in memory.
+CACHE_SIZE = 32
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+class View:
+
+    """Offsets of a view in the file. The keys dictionary has the spans of all the
+    values in the view object, and the annotation spans are kept in two arrays
+    since there can be hundreds of thousands of them."""
+
+    def __init__(self, start: int):
+        self.start = start
+        self.end = None
+        self.keys = {}
+        self.annotation_starts = array('q')
+        self.annotation_ends = array('q')
+        # counts of annotation types, collected while finding the annotations
+        self.types = Counter()
+
+    def __len__(self):
+        return len(self.annotation_starts)
+
+
+class MmifIndex:
+
+    """Byte offsets of the parts of a MMIF file."""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        stat = self.path.stat()
+        self.size = stat.st_size
+        self.mtime = stat.st_mtime_ns
+        # spans of values in the top-level object, indexed on the key
+        self.keys = {}
+        self.document_starts = array('q')
+        self.document_ends = array('q')
+        self.views = []
+        if self.size:
+            with self.path.open('rb') as fh:
+                with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    self.scan(mm)
+
+    def scan(self, data):
+        """Walk through all tokens and keep track of where we are in the structure,
+        using a stack of frames. Each frame is a list with the container character,
+        the path to the container, the start of the current value, whether we are
+        expecting a key, the current key or index and whether a value was seen.
+        Documents and annotations are not tokenized, instead the JSON parser finds
+        where they end, which is much faster."""
+        stack = []
+        view = None
+        window = Window(data)
+        position = 0
+        while True:
+            for match in TOKENS.finditer(data, position):
+                token = match.group()
+                char = token[:1]
+                if char == b'"':
+                    if stack:
+                        frame = stack[-1]
+                        if frame[0] == b'{' and frame[3]:
+                            frame[4] = token[1:-1].decode('utf8')
+                            frame[3] = False
+                        else:
+                            frame[5] = True
+                elif not stack and char != b'{' and char != b'[':
+                    # a separator or a closing bracket outside of any container
+                    raise ValueError(f'not a complete MMIF file: {self.path}')
+                elif char == b':':
+                    stack[-1][2] = match.end()
+                elif char == b'{' or char == b'[':
+                    if stack:
+                        parent = stack[-1]
+                        parent[5] = True
+                        path = parent[1] + (parent[4],)
+                    else:
+                        path = ()
+                    if char == b'[' and path == ('documents',):
+                        position = window.scan_array(
+                            match.end(), self.document_starts, self.document_ends)
+                        break
+                    annotations_path = ('views', len(self.views) - 1, 'annotations')
+                    if char == b'[' and view is not None and path == annotations_path:
+                        position = window.scan_array(
+                            match.end(), view.annotation_starts, view.annotation_ends,
+                            view.types)
+                        break
+                    if path == ('views', len(self.views)):
+                        view = View(match.start())
+                        self.views.append(view)
+                    stack.append([char, path, match.end(), char == b'{', 0 if char == b'[' else None, False])
+                elif char == b',' or char == b'}' or char == b']':
+                    frame = stack[-1]
+                    self.add_span(frame, frame[2], match.start(), view)
+                    if char == b',':
+                        frame[2] = match.end()
+                        frame[5] = False
+                        if frame[0] == b'{':
+                            frame[3] = True
+                        else:
+                            frame[4] += 1
+                    else:
+                        stack.pop()
+                        if frame[1] == ('views', len(self.views) - 1):
+                            view.end = match.end()
+                        if not stack:
+                            break
+            else:
+                break
+            if not stack:
+                break
+        if stack or not self.keys:
+            raise ValueError(f'not a complete MMIF file: {self.path}')
+
+    def add_span(self, frame: list, start: int, end: int, view: View):
+        """Record the span of a value that just ended in one of the containers that
+        we keep offsets for."""
+        kind, path, _, _, key, seen = frame
+        if kind == b'{' and key is None:
+            # empty object
+            return
+        if kind == b'[' and not seen:
+            # empty array or an array of numbers or constants
+            return
+        if path == ():
+            self.keys[key] = (start, end)
+        elif path == ('documents',):
+            self.document_starts.append(start)
+            self.document_ends.append(end)
+        elif len(path) == 2 and path[0] == 'views':
+            view.keys[key] = (start, end)
+        elif len(path) == 3 and path[0] == 'views' and path[2] == 'annotations':
+            view.annotation_starts.append(start)
+            view.annotation_ends.append(end)
+
+
+class Window:
+
+    """A decoded piece of the file, used to hand the values in an array to the
+    JSON parser one by one. The window moves forward through the file and grows
+    when a value does not fit."""
+
+    def __init__(self, data):
+        self.data = data
+        self.offset = 0
+        self.text = ''
+        self.ascii = True
+        self.at_end = False
+        # a byte position and the character position in the text it maps to
+        self.byte = 0
+        self.char = 0
+
+    def load(self, position: int, size: int):
+        end = min(position + size, len(self.data))
+        # do not cut a multi-byte character in half
+        while end < len(self.data) and self.data[end] & 0xc0 == 0x80:
+            end -= 1
+        self.offset = position
+        self.text = self.data[position:end].decode('utf8')
+        self.ascii = self.text.isascii()
+        self.at_end = end == len(self.data)
+        self.byte = self.char = 0
+
+    def value_end(self, position: int):
+        """Return the JSON value at a position and the byte position where it ends.
+        Between two values in the same array there is only whitespace and a comma,
+        which are single bytes, so the distance in characters from the last value
+        is the distance in bytes. This does not hold between arrays, where there
+        can be any text, so scan_array() loads the window again for each array."""
+        size = WINDOW_SIZE
+        while True:
+            byte = position - self.offset
+            if byte < self.byte or byte >= len(self.text) + self.byte - self.char:
+                self.load(position, size)
+                byte = 0
+            char = self.char + byte - self.byte
+            try:
+                value, end = DECODER.raw_decode(self.text, char)
+                if end < len(self.text) or self.at_end:
+                    break
+            except json.JSONDecodeError:
+                if self.at_end:
+                    raise ValueError(f'invalid JSON at byte {position}')
+            size *= 2
+            self.load(position, size)
+        length = end - char if self.ascii else len(self.text[char:end].encode('utf8'))
+        self.byte = byte + length
+        self.char = end
+        return value, position + length
+
+    def scan_array(self, position: int, starts: array, ends: array, types: Counter = None):
+        """Add the spans of all values in the array that starts just before the
+        position to the arrays and return the position after the array. If a
+        counter is handed in the types of the values are counted."""
+        data = self.data
+        self.load(position, WINDOW_SIZE)
+        while True:
+            position = WHITESPACE.match(data, position).end()
+            if data[position:position + 1] == b']':
+                return position + 1
+            value, end = self.value_end(position)
+            if types is not None and isinstance(value, dict):
+                types[value.get('@type')] += 1
+            starts.append(position)
+            ends.append(end)
+            position = WHITESPACE.match(data, end).end()
+            if data[position:position + 1] == b',':
+                position += 1
+
+
+class MmifFile:
+
+    """Paged access to a MMIF file. Reading a page of annotations only reads and
+    parses the bytes for those annotations."""
+
+    def __init__(self, path: Path, cache: bool = True):
+        self.path = Path(path)
+        self.index = get_index(self.path) if cache else MmifIndex(self.path)
+
+    def __str__(self):
+        return f'<{self.__class__.__name__} {self.path.name} views={len(self.index.views)}>'
+
+    def read(self, start: int, end: int):
+        with self.path.open('rb') as fh:
+            fh.seek(start)
+            timing.add_bytes(end - start)
+            return json.loads(fh.read(end - start))
+
+    def section(self, key: str):
+        """Return the parsed value of a top-level key like "metadata". Beware that
+        for "documents" and "views" this reads the entire section."""
+        span = self.index.keys.get(key)
+        return None if span is None else self.read(*span)
+
+    @property
+    def metadata(self):
+        return self.section('metadata')
+
+    @property
+    def document_count(self):
+        return len(self.index.document_starts)
+
+    @property
+    def view_count(self):
+        return len(self.index.views)
+
+    def documents(self, offset: int = 0, count: int = 10):
+        index = self.index
+        return [self.read(index.document_starts[i], index.document_ends[i])
+                for i in range(offset, min(offset + count, self.document_count))]
+
+    def view_value(self, view: int, key: str):
+        """Return the value of a key in a view, without reading the annotations."""
+        span = self.index.views[view].keys.get(key)
+        return None if span is None else self.read(*span)
+
+    def view_info(self, view: int):
+        """Return the identifier, the metadata and the number of annotations of a
+        view."""
+        return {
+            'id': self.view_value(view, 'id'),
+            'metadata': self.view_value(view, 'metadata'),
+            'annotations': len(self.index.views[view]) }
+
+    def annotations(self, view: int, offset: int = 0, count: int = 10):
+        """Return a page of annotations from a view."""
+        view = self.index.views[view]
+        end = min(offset + count, len(view))
+        if offset >= end:
+            return []
+        # all annotations on the page are read in one go
+        with self.path.open('rb') as fh:
+            fh.seek(view.annotation_starts[offset])
+            data = fh.read(view.annotation_ends[end - 1] - view.annotation_starts[offset])
+        timing.add_bytes(len(data))
+        base = view.annotation_starts[offset]
+        return [json.loads(data[view.annotation_starts[i] - base:view.annotation_ends[i] - base])
+                for i in range(offset, end)]
+
+
+@timing.timed('mmif.get_index')
+def get_index(path: Path):
+    """Return the index for a file, using a cached index if the size and the
+    modification time of the file did not change."""
+    stat = path.stat()
+    key = (str(path.resolve()), stat.st_size, stat.st_mtime_ns)
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+    index = MmifIndex(path)
+    with _cache_lock:
+        _cache[key] = index
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return index
+
+
+def summarize(path: Path):
+    """Return a summary of a MMIF file with the number of documents, views and
+    annotations, the apps that created the views, counts for each annotation type
+    and the identifiers of views with errors or warnings. Type counts are taken
+    from the index so annotations are not read again."""
+    mmif_file = MmifFile(path, cache=False)
+    apps = []
+    types = Counter()
+    errors = []
+    warnings = []
+    for view in range(mmif_file.view_count):
+        info = mmif_file.view_info(view)
+        metadata = info['metadata'] or {}
+        if metadata.get('app') not in apps:
+            apps.append(metadata.get('app'))
+        if 'error' in metadata:
+            errors.append(info['id'])
+        if 'warnings' in metadata:
+            warnings.append(info['id'])
+        types.update(mmif_file.index.views[view].types)
+    return {
+        'documents': mmif_file.document_count,
+        'views': mmif_file.view_count,
+        'apps': apps,
+        'annotations': sum(types.values()),
+        'types': dict(types),
+        'errors': errors,
+        'warnings': warnings }
+
+
+def _summarize(path: str):
+    try:
+        return summarize(Path(path))
+    except (ValueError, OSError) as e:
+        return { 'failed': str(e) }
+
+
+def summarize_files(directory: Path, file_names: list, workers: int = None):
+    """Return summaries for MMIF files in a directory, in the order of the file
+    names. Summaries are cached on disk for each directory and a file is only read
+    again if its size or modification time changed. Files that are not in the
+    cache are divided over a pool of processes."""
+    directory = Path(directory)
+    digest = hashlib.sha1(str(directory.resolve()).encode('utf8')).hexdigest()
+    cache_name = f'summaries-{digest[:16]}'
+    cache = utils.read_cache(cache_name) or {}
+    summaries = {}
+    todo = []
+    for name in file_names:
+        stat = (directory / name).stat()
+        key = [stat.st_size, stat.st_mtime_ns]
+        cached = cache.get(name)
+        if cached is not None and cached['key'] == key:
+            summaries[name] = cached['summary']
+        else:
+            todo.append((name, key))
+    if todo:
+        paths = [str(directory / name) for name, _ in todo]
+        workers = workers or config.WORKERS or os.cpu_count()
+        if len(paths) == 1 or workers == 1:
+            results = map(_summarize, paths)
+        else:
+            with ProcessPoolExecutor(max_workers=min(workers, len(paths))) as executor:
+                chunksize = max(1, len(paths) // (workers * 4))
+                results = list(executor.map(_summarize, paths, chunksize=chunksize))
+        for (name, key), summary in zip(todo, results):
+            summaries[name] = summary
+            cache[name] = { 'key': key, 'summary': summary }
+        utils.write_cache(cache_name, cache)
+    return [summaries[name] for name in file_names]
+
+
+
+if __name__ == '__main__':
+
+    import sys
+
+    mmif = MmifFile(sys.argv[1])
+    print(mmif)
+    print(mmif.metadata)
+    for i in range(mmif.view_count):
+        print(mmif.view_info(i))
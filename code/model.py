@@ -1,39 +1,214 @@
+import time
+import threading
+
 import config
+import utils
+import mmif
+import store
+import search
 import annotation
 import evaluation
+import timing
 
 
 class Data:
 
     """Class used for when we need access to information from both the annotations
-    and the evaluations."""
+    and the evaluations. One instance is shared by all sessions of the dashboard,
+    so any changes to the repositories should go through methods that lock.
+
+    Both repositories are also written to an SQLite store, which has the queries
+    that need data from more than one task, batch or evaluation."""
 
+    @timing.timed('model.load')
     def __init__(self, annotations_repo: str, evaluations_repo: str):
-        self.annotations = annotation.Repository(annotations_repo)
-        self.evaluations = evaluation.Repository(evaluations_repo)
+        self.setup(annotation.Repository(annotations_repo),
+                   evaluation.Repository(evaluations_repo),
+                   store.database_path(annotations_repo, evaluations_repo))
+
+    @classmethod
+    def from_repositories(cls, annotations, evaluations, database: str):
+        """Create the model from repositories that are already loaded."""
+        data = cls.__new__(cls)
+        data.setup(annotations, evaluations, database)
+        return data
+
+    def setup(self, annotations, evaluations, database: str):
+        self.annotations = annotations
+        self.evaluations = evaluations
+        self.store = store.Store(database)
+        self.store.sync(self.annotations, self.evaluations)
+        self._coverage = Coverage()
+        # the search index is updated on the first search after a load or refresh
+        self._search = search.SearchIndex()
+        self._search_current = False
+        self._lock = threading.Lock()
 
     def __str__(self):
         return f'<Data>\n    {self.annotations}\n    {self.evaluations}'
 
+    def refresh(self):
+        """Pick up changes in both repositories, returns a list of what changed."""
+        with self._lock:
+            changed = self.annotations.refresh() + self.evaluations.refresh()
+            self.store.sync(self.annotations, self.evaluations)
+            # edits of gold files are not in what changed, so always index again
+            self._search_current = False
+            return changed
+
     def batch_usage_in_system_predictions(self, batch_name: str):
         """For a batch name from the annotation repository, return a list of pairs with
         evaluation name and system predictions name."""
-        data = []
-        for evaluation in self.evaluations:
-            for prediction in evaluation.predictions:
-                if prediction.prediction_batch == batch_name:
-                    data.append([evaluation.name, prediction.name])
-        return data
+        return [list(pair) for pair in self.store.batch_predictions(batch_name)]
 
     def batch_usage_in_system_reports(self, batch_name: str):
         """For a batch name from the annotation repository, return a list of pairs with
         evaluation name and system report name."""
-        data = []
-        for evaluation in self.evaluations:
-            for report in evaluation.get_reports():
-                if report.report_batch == batch_name:
-                    data.append([evaluation.name, report.name])
-        return data
+        return [list(pair) for pair in self.store.batch_reports(batch_name)]
+
+    def coverage(self):
+        """Return the GUID coverage of all prediction batches, see Coverage."""
+        self._coverage.update(self.annotations, self.evaluations)
+        return self._coverage
+
+    def search(self, query: str, limit: int = 20):
+        """Return the best hits for a query, see search.SearchIndex."""
+        with self._lock:
+            if not self._search_current:
+                self._search.update(self.annotations, self.evaluations)
+                self._search_current = True
+        return self._search.search(query, limit)
+
+    def memory_report(self):
+        """Return estimates of the bytes used by each repository. Snapshots of the
+        annotation repository are given separately and GUIDs, which are shared by
+        all repositories, are counted once."""
+        seen = set()
+        report = { 'guids': utils.memory_size(utils.GUIDS, seen) }
+        snapshots = self.annotations._snapshots
+        seen.add(id(snapshots))
+        report['annotations'] = utils.memory_size(self.annotations, seen)
+        seen.discard(id(snapshots))
+        report['annotation snapshots'] = utils.memory_size(snapshots, seen)
+        report['evaluations'] = utils.memory_size(self.evaluations, seen)
+        report['mmif indexes'] = utils.memory_size(mmif._cache, seen)
+        report['search index'] = utils.memory_size(self._search, seen)
+        return report
+
+
+
+class Loader:
+
+    """Loads the model in a background thread. The annotation repository is
+    available as soon as it is loaded, the model when the evaluation repository
+    and the store are done as well. Use wait() to block until one of those
+    stages is reached."""
+
+    STAGES = ['annotations', 'ready']
+
+    def __init__(self, annotations_repo: str, evaluations_repo: str):
+        self.annotations_repo = annotations_repo
+        self.evaluations_repo = evaluations_repo
+        self.annotations = None
+        self.data = None
+        self.error = None
+        # what is being loaded, this is shown to users while they wait
+        self.stage = 'annotations'
+        self.start = time.time()
+        self._events = { stage: threading.Event() for stage in self.STAGES }
+        self._thread = threading.Thread(target=self.run, name='model-loader', daemon=True)
+        self._thread.start()
+
+    def __str__(self):
+        return f'<{self.__class__.__name__} {self.stage}>'
+
+    @timing.timed('model.load')
+    def run(self):
+        try:
+            self.annotations = annotation.Repository(self.annotations_repo)
+            self._events['annotations'].set()
+            self.stage = 'evaluations'
+            evaluations = evaluation.Repository(self.evaluations_repo)
+            self.stage = 'store'
+            database = store.database_path(self.annotations_repo, self.evaluations_repo)
+            self.data = Data.from_repositories(self.annotations, evaluations, database)
+            self.stage = 'ready'
+        except Exception as e:
+            self.error = e
+            self.stage = 'failed'
+        finally:
+            for event in self._events.values():
+                event.set()
+            timing.end_rerun()
+
+    @property
+    def seconds(self):
+        return time.time() - self.start
+
+    def wait(self, stage: str = 'ready', timeout: float = None):
+        """Wait until a stage is reached or loading failed, returns False if the
+        timeout ran out first."""
+        return self._events[stage].wait(timeout)
+
+
+class Coverage:
+
+    """GUID coverage of all prediction batches in the evaluation repository. For
+    each prediction batch this has the GUIDs in its annotation batch that have no
+    prediction, the predictions that are not on a GUID with a gold file in any
+    task and the GUIDs in the annotation batch with a gold file but without a
+    prediction. GUIDs of batches, gold files and predictions are all bitsets from
+    utils.GUIDS, so this is a few integer operations for each prediction batch.
+    Bitsets for prediction batches are kept with the signature of the prediction
+    directory and are only made again if the directory changed."""
+
+    KINDS = ['missing predictions', 'predictions without gold', 'gold without predictions']
+
+    COLUMNS = ['evaluation', 'predictions', 'batch', 'batch size', 'files'] + KINDS
+
+    def __init__(self):
+        # (evaluation name, prediction name) pairs to signatures and bitsets
+        self._predictions = {}
+        self._bitsets = {}
+        self.rows = []
+
+    @timing.timed('model.coverage')
+    def update(self, annotations, evaluations):
+        overlaps = annotations.overlaps
+        gold = 0
+        for task_bits in overlaps.tasks.values():
+            gold |= task_bits
+        predictions = {}
+        bitsets = {}
+        rows = []
+        for evaluation in evaluations.evaluations:
+            for prediction in sorted(evaluation.predictions):
+                key = (evaluation.name, prediction.name)
+                cached = self._predictions.get(key)
+                if cached is None or cached[0] != prediction.signature:
+                    cached = (prediction.signature, utils.GUIDS.bitset(prediction.guids()))
+                predictions[key] = cached
+                predicted = cached[1]
+                batch = overlaps.batches.get(prediction.prediction_batch, 0)
+                bitsets[key] = {
+                    'missing predictions': batch & ~predicted,
+                    'predictions without gold': predicted & ~gold,
+                    'gold without predictions': batch & gold & ~predicted }
+                rows.append(
+                    [evaluation.name, prediction.name, prediction.prediction_batch,
+                     utils.popcount(batch), utils.popcount(predicted)]
+                    + [utils.popcount(bitsets[key][kind]) for kind in self.KINDS])
+        self._predictions = predictions
+        self._bitsets = bitsets
+        self.rows = rows
+
+    def evaluation_rows(self, evaluation: str):
+        return [row for row in self.rows if row[0] == evaluation]
+
+    def guids(self, evaluation: str, prediction: str, kind: str):
+        """Return the GUIDs of one kind for a prediction batch, where the kind is
+        one of the names in KINDS."""
+        return utils.GUIDS.members(self._bitsets[(evaluation, prediction)][kind])
 
 
 
@@ -41,6 +216,11 @@ if __name__ == '__main__':
 
     data = Data(config.ANNOTATIONS, config.EVALUATIONS)
     print(data)
+    for name, size in data.memory_report().items():
+        print(f'{name:>20s}  {utils.human_size(size)}')
+    print()
+    for row in data.coverage().rows:
+        print('   ', row)
     for batch_name in data.annotations.batch_names:
         print(f'\n{data.annotations.batch(batch_name)}')
         batch_usage = data.batch_usage_in_system_predictions(batch_name)
@@ -0,0 +1,136 @@
+"""Cache for rendered file content
+
+Showing a file means reading it and, for JSON, parsing it and printing it again
+with indentation, and Streamlit does that again on every rerun, even when the
+user only went to another tab. The RenderCache keeps the text that was shown,
+keyed on the file and on what was done with it, so showing the same file or the
+same page of a file again costs a dictionary lookup.
+
+Files are identified by their size and modification time or, for files read
+from git, by the SHA of the blob, so an edited file is never shown from the
+cache. The cache has a budget in bytes and drops the least recently used text
+when it goes over it. It is shared by all sessions and safe to use from any
+thread.
+
+"""
+
+import sys
+import json
+import threading
+from collections import OrderedDict
+
+import config
+import utils
+import timing
+
+
+class RenderCache:
+
+    """Least recently used cache of rendered text with a budget in bytes."""
+
+    def __init__(self, budget: int):
+        self.budget = budget
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __str__(self):
+        return (f'<{self.__class__.__name__} entries={len(self)}'
+                + f' size={utils.human_size(self.size)} hit_rate={self.hit_rate:.2f}>')
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def get(self, key: tuple, render):
+        """Return the cached text for a key or, if there is none, call render to make
+        it and add it to the cache. Two threads asking for the same missing key can
+        both render it, which is cheaper than making one of them wait."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+        value = render()
+        self.add(key, value)
+        return value
+
+    def add(self, key: tuple, value):
+        size = sys.getsizeof(value)
+        if size > self.budget:
+            return
+        with self._lock:
+            if key in self._entries:
+                self.size -= self._entries.pop(key)[1]
+            self._entries[key] = (value, size)
+            self.size += size
+            while self.size > self.budget:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.size -= evicted
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def stats(self):
+        return {
+            'entries': len(self),
+            'bytes': self.size,
+            'budget': self.budget,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit rate': self.hit_rate }
+
+
+CACHE = RenderCache(config.RENDER_CACHE_SIZE)
+
+
+def cached(path, how: tuple, render):
+    """Return the text rendered from a file, where how says what was done to the file
+    to get the text, for example ('pretty',) or ('page', 2)."""
+    return CACHE.get(utils.file_key(path) + how, render)
+
+
+def file_text(path):
+    """Return the content of a file."""
+    return cached(path, ('text',), lambda: read_text(path))
+
+
+def pretty_text(path):
+    """Return the content of a file, with JSON and MMIF files pretty-printed."""
+    def render():
+        content = read_text(path)
+        if path.suffix in ('.json', '.mmif'):
+            return json.dumps(json.loads(content), indent=2)
+        return content
+    return cached(path, ('pretty',), render)
+
+
+def read_text(path):
+    with path.open() as fh:
+        content = fh.read()
+    timing.add_bytes(len(content))
+    return content
+
+
+
+if __name__ == '__main__':
+
+    from pathlib import Path
+
+    for name in sys.argv[1:]:
+        pretty_text(Path(name))
+        pretty_text(Path(name))
+    print(CACHE)
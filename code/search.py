@@ -0,0 +1,276 @@
+"""Full-text search over both repositories
+
+An inverted index over the readme of the annotation repository, the readme and
+the process code of each task, batch comments, gold files, the readmes of the
+evaluations and the reports. Hits are ranked with BM25 and come with a snippet
+of the text around the first match.
+
+Postings are keyed on the hash of the content instead of on the document. This
+is the blob SHA, which git already has for files read from a commit and which is
+computed from the content for other files and texts, so a file that is in more
+than one place is tokenized once. When the index is updated only content with a
+new hash is tokenized, and files on disk are only read again if their size or
+modification time changed. Term counts of all content and the hashes of files
+are saved in the cache directory, so after a restart nothing is tokenized again.
+
+"""
+
+import re
+import math
+import hashlib
+import threading
+from collections import namedtuple, Counter
+
+import utils
+import timing
+
+
+# Version of the saved index, an index with another version is not used.
+INDEX_VERSION = 1
+
+# Terms longer than this are not indexed, these are mostly identifiers and noise
+# from JSON files.
+MAX_TERM_LENGTH = 40
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+# For each kind of document the dashboard page and the tab that shows it.
+KINDS = {
+    'repository readme': ('Annotation viewer', 'Repository readme file'),
+    'task readme': ('Annotation viewer', 'Tasks - Readme'),
+    'task process': ('Annotation viewer', 'Tasks - Process.py'),
+    'gold file': ('Annotation viewer', 'Tasks - Gold files'),
+    'batch comment': ('Annotation viewer', 'Batches'),
+    'evaluation readme': ('Evaluation viewer', 'Readme'),
+    'report': ('Evaluation viewer', 'Reports') }
+
+TERM = re.compile(r'\w+')
+
+# A document is one searchable text. The target is the task, batch or evaluation
+# it belongs to and the name is the file name inside of it, both can be None.
+# The source is the text itself or the path it is read from.
+Document = namedtuple('Document', ['kind', 'target', 'name', 'source'])
+
+Hit = namedtuple('Hit', ['document', 'score', 'snippet'])
+
+
+class SearchIndex:
+
+    """Inverted index from terms to content hashes, with the documents that have
+    the content for each hash. All changes are made under a lock and queries see
+    either the index before or after an update."""
+
+    def __init__(self):
+        # content hashes to term counts and terms to content hashes with counts
+        self._terms = {}
+        self._postings = {}
+        self._lengths = {}
+        # content hashes to documents
+        self._documents = {}
+        # paths of files on disk to the signature and hash of the file
+        self._files = {}
+        self._loaded = False
+        self._changed = False
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return sum(len(documents) for documents in self._documents.values())
+
+    def __str__(self):
+        return (f'<{self.__class__.__name__} documents={len(self)}'
+                + f' contents={len(self._terms)} terms={len(self._postings)}>')
+
+    @timing.timed('search.update')
+    def update(self, annotations, evaluations):
+        """Index the documents in the repositories, only tokenizing content that is
+        not in the index yet, and drop content that is not used anymore."""
+        with self._lock:
+            if not self._loaded:
+                self.load()
+            documents = self.documents(annotations, evaluations)
+            threads = 1 if isinstance(annotations.root, utils.GitPath) else None
+            hashes = utils.parallel_map(self.read, documents, threads)
+            by_hash = {}
+            for document, sha in zip(documents, hashes):
+                if sha is not None:
+                    by_hash.setdefault(sha, []).append(document)
+            for sha in set(self._terms) - set(by_hash):
+                self.remove(sha)
+            paths = { str(document.source) for document in documents }
+            for path in set(self._files) - paths:
+                del self._files[path]
+                self._changed = True
+            self._documents = by_hash
+            if self._changed:
+                self.save()
+            timing.add_objects(len(documents))
+
+    def documents(self, annotations, evaluations):
+        documents = [Document('repository readme', None, 'README.md', annotations.readme)]
+        for task in annotations.tasks:
+            documents.append(Document('task readme', task.name, 'readme.md', task.readme_file))
+            documents.append(Document('task process', task.name, 'process.py', task.process_file))
+            documents.extend(
+                Document('gold file', task.name, name, task.gold_directory / name)
+                for name in task.gold_file_names)
+        for name in annotations.batch_names:
+            batch = annotations.batch(name)
+            documents.append(Document('batch comment', name, batch.name, batch.comment))
+        for evaluation in evaluations.evaluations:
+            documents.append(
+                Document('evaluation readme', evaluation.name, evaluation.readme_file.name,
+                         evaluation.readme_file))
+            documents.extend(
+                Document('report', evaluation.name, report.name, report.path)
+                for report in evaluation.get_reports())
+        return documents
+
+    def read(self, document: Document):
+        """Return the hash of the content of a document, adding the content to the
+        index if the hash is new. Returns None if there is no such file."""
+        source = document.source
+        if isinstance(source, str):
+            data = source.encode('utf8')
+            return self.add(content_hash(data), data)
+        if isinstance(source, utils.GitPath):
+            if not source.is_file():
+                return None
+            if source.hexsha in self._terms:
+                return source.hexsha
+            return self.add(source.hexsha, source.read_bytes())
+        path = str(source)
+        signature = utils.signature(source)
+        if signature is None or not source.is_file():
+            return None
+        cached = self._files.get(path)
+        if cached is not None and cached[0] == signature and cached[1] in self._terms:
+            return cached[1]
+        data = source.read_bytes()
+        timing.add_bytes(len(data))
+        sha = self.add(content_hash(data), data)
+        self._files[path] = [signature, sha]
+        self._changed = True
+        return sha
+
+    def add(self, sha: str, data: bytes):
+        if sha in self._terms:
+            return sha
+        # the same content can be added by two threads, the second is ignored
+        terms = Counter(tokenize(data.decode('utf8', errors='replace')))
+        if self._terms.setdefault(sha, terms) is terms:
+            self.post(sha, terms)
+            self._changed = True
+        return sha
+
+    def post(self, sha: str, terms: dict):
+        self._lengths[sha] = sum(terms.values())
+        for term, count in terms.items():
+            self._postings.setdefault(term, {})[sha] = count
+
+    def remove(self, sha: str):
+        for term in self._terms.pop(sha):
+            postings = self._postings[term]
+            del postings[sha]
+            if not postings:
+                del self._postings[term]
+        del self._lengths[sha]
+        self._changed = True
+
+    @timing.timed('search.query')
+    def search(self, query: str, limit: int = 20):
+        """Return the best hits for a query, where all terms of the query have to
+        be in a document. Snippets are only made for the hits returned."""
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return []
+        with self._lock:
+            postings = [self._postings.get(term, {}) for term in terms]
+            if not all(postings):
+                return []
+            total = len(self._lengths)
+            average = sum(self._lengths.values()) / total
+            scores = {}
+            for sha in set.intersection(*[set(p) for p in sorted(postings, key=len)]):
+                length = self._lengths[sha]
+                scores[sha] = sum(
+                    bm25(p[sha], len(p), total, length, average) for p in postings)
+            ranked = []
+            for sha in sorted(scores, key=scores.get, reverse=True):
+                for document in self._documents.get(sha, []):
+                    ranked.append((document, scores[sha]))
+                if len(ranked) >= limit:
+                    break
+        return [Hit(document, score, snippet(read_text(document.source), terms))
+                for document, score in ranked[:limit]]
+
+    def load(self):
+        index = utils.read_cache('search-index')
+        if index is not None and index.get('version') == INDEX_VERSION:
+            self._terms = index['terms']
+            self._files = index['files']
+            for sha, terms in self._terms.items():
+                self.post(sha, terms)
+        self._loaded = True
+
+    def save(self):
+        utils.write_cache(
+            'search-index',
+            { 'version': INDEX_VERSION, 'terms': self._terms, 'files': self._files })
+        self._changed = False
+
+
+def tokenize(text: str):
+    return [term for term in TERM.findall(text.lower()) if len(term) <= MAX_TERM_LENGTH]
+
+
+def content_hash(data: bytes):
+    """Return the SHA that git gives to a blob with this content."""
+    sha = hashlib.sha1(b'blob %d\0' % len(data))
+    sha.update(data)
+    return sha.hexdigest()
+
+
+def bm25(count: int, documents: int, total: int, length: int, average: float):
+    """Score of a term with a count in a document, where documents is the number
+    of documents with the term and total the number of all documents."""
+    idf = math.log((total - documents + 0.5) / (documents + 0.5) + 1)
+    return idf * count * (K1 + 1) / (count + K1 * (1 - B + B * length / average))
+
+
+def read_text(source):
+    if isinstance(source, str):
+        return source
+    return utils.read_file(source)
+
+
+def snippet(text: str, terms: list, width: int = 80):
+    """Return the text around the first match of one of the terms."""
+    pattern = re.compile(r'\b(' + '|'.join(re.escape(term) for term in terms) + r')\b',
+                         re.IGNORECASE)
+    match = pattern.search(text)
+    if match is None:
+        return ' '.join(text[:width * 2].split())
+    start = max(0, match.start() - width)
+    end = min(len(text), match.end() + width)
+    prefix = '...' if start > 0 else ''
+    suffix = '...' if end < len(text) else ''
+    return prefix + ' '.join(text[start:end].split()) + suffix
+
+
+
+if __name__ == '__main__':
+
+    import sys
+    import config
+    import annotation
+    import evaluation
+
+    index = SearchIndex()
+    index.update(annotation.Repository(config.ANNOTATIONS),
+                 evaluation.Repository(config.EVALUATIONS))
+    print(index)
+    for hit in index.search(' '.join(sys.argv[1:])):
+        print(f'\n{hit.score:6.2f}  {hit.document.kind}  {hit.document.target}'
+              + f'  {hit.document.name}\n        {hit.snippet}')
@@ -0,0 +1,294 @@
+"""SQLite store for the dashboard model
+
+The tasks, batches and batch GUIDs, gold files and data drops of the annotation
+repository and the evaluations, prediction batches, MMIF files and reports of
+the evaluation repository are written to an SQLite database with indexes on
+batch names and GUIDs. Questions like "which prediction files are on this GUID"
+are then indexed queries instead of loops over the Python objects.
+
+The database is kept in the cache directory and survives restarts. Each item is
+stored with the signature it had when it was written, and when the store is
+synced only items whose signature changed are written again. This also means
+that after a restart the MMIF files in prediction batches that did not change
+are not listed again.
+
+"""
+
+import json
+import sqlite3
+import hashlib
+import threading
+from pathlib import Path
+
+import config
+import timing
+
+
+# Version of the schema, a database with another version is rebuilt.
+SCHEMA_VERSION = 1
+
+SCHEMA = '''
+CREATE TABLE signatures (kind TEXT, name TEXT, signature TEXT, PRIMARY KEY (kind, name));
+CREATE TABLE batches (name TEXT PRIMARY KEY, file TEXT, size INTEGER);
+CREATE TABLE batch_guids (batch TEXT, guid TEXT);
+CREATE INDEX batch_guids_batch ON batch_guids (batch);
+CREATE INDEX batch_guids_guid ON batch_guids (guid);
+CREATE TABLE tasks (name TEXT PRIMARY KEY, gold_files INTEGER);
+CREATE TABLE gold_files (task TEXT, name TEXT, guid TEXT);
+CREATE INDEX gold_files_task ON gold_files (task);
+CREATE INDEX gold_files_guid ON gold_files (guid);
+CREATE TABLE data_drops (task TEXT, name TEXT);
+CREATE INDEX data_drops_task ON data_drops (task);
+CREATE TABLE evaluations (name TEXT PRIMARY KEY);
+CREATE TABLE predictions (key TEXT PRIMARY KEY, evaluation TEXT, name TEXT, app TEXT, batch TEXT);
+CREATE INDEX predictions_evaluation ON predictions (evaluation);
+CREATE INDEX predictions_batch ON predictions (batch);
+CREATE TABLE prediction_files (prediction TEXT, name TEXT, guid TEXT);
+CREATE INDEX prediction_files_prediction ON prediction_files (prediction);
+CREATE INDEX prediction_files_guid ON prediction_files (guid);
+CREATE TABLE reports (key TEXT PRIMARY KEY, evaluation TEXT, name TEXT, tool TEXT, batch TEXT);
+CREATE INDEX reports_evaluation ON reports (evaluation);
+CREATE INDEX reports_batch ON reports (batch);
+'''
+
+# For each kind of item the tables and the column that holds the item name.
+TABLES = {
+    'batch': [('batches', 'name'), ('batch_guids', 'batch')],
+    'task': [('tasks', 'name'), ('gold_files', 'task'), ('data_drops', 'task')],
+    'evaluation': [('evaluations', 'name')],
+    'prediction': [('predictions', 'key'), ('prediction_files', 'prediction')],
+    'report': [('reports', 'key')] }
+
+
+class Store:
+
+    """An SQLite database with the model data. One connection is shared by all
+    threads and every use of it goes through a lock."""
+
+    def __init__(self, path: str):
+        self.path = path
+        if path != ':memory:':
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        version = self.connection.execute('PRAGMA user_version').fetchone()[0]
+        if version != SCHEMA_VERSION:
+            self.create()
+
+    def __str__(self):
+        return f'<{self.__class__.__name__} {self.path}>'
+
+    def create(self):
+        with self.connection:
+            tables = self.connection.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table'").fetchall()
+            for (table,) in tables:
+                self.connection.execute(f'DROP TABLE {table}')
+            self.connection.executescript(SCHEMA)
+            self.connection.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+
+    def query(self, sql: str, parameters: tuple = ()):
+        with self._lock:
+            return self.connection.execute(sql, parameters).fetchall()
+
+    @timing.timed('store.sync')
+    def sync(self, annotations, evaluations):
+        """Bring the database up to date with the repositories and return the names
+        of the items that were written or removed, prefixed with their kind."""
+        changed = []
+        # the repository has signatures of its batches and tasks, computing them
+        # again for tasks in the working tree would mean listing their directories
+        signatures = annotations._signatures
+        batches = annotations._batches
+        tasks = annotations._tasks
+        predictions = {}
+        reports = {}
+        for evaluation in evaluations.evaluations:
+            for prediction in evaluation.predictions:
+                predictions[f'{evaluation.name}/{prediction.name}'] = prediction
+            for report in evaluation.get_reports():
+                reports[f'{evaluation.name}/{report.name}'] = report
+        with self._lock, self.connection:
+            changed += self.update(
+                'batch', batches,
+                { name: signatures.get(f'batch:{name}') for name in batches },
+                self.write_batch)
+            changed += self.update(
+                'task', tasks,
+                { name: signatures.get(f'task:{name}') for name in tasks },
+                self.write_task)
+            changed += self.update(
+                'evaluation', evaluations.evaluations_idx,
+                { name: None for name in evaluations.evaluations_idx },
+                self.write_evaluation)
+            changed += self.update(
+                'prediction', predictions,
+                { key: prediction.signature for key, prediction in predictions.items() },
+                self.write_prediction)
+            changed += self.update(
+                'report', reports,
+                { key: report.signature for key, report in reports.items() },
+                self.write_report)
+        timing.add_objects(len(changed))
+        return changed
+
+    def update(self, kind: str, items: dict, signatures: dict, write):
+        """Write the rows for one kind of item. Items and signatures are dictionaries
+        indexed on item names and write adds the rows for an item. Only items with
+        a signature that is not the one in the database are written and items that
+        are gone are removed."""
+        stored = dict(self.connection.execute(
+            'SELECT name, signature FROM signatures WHERE kind = ?', (kind,)))
+        changed = []
+        for name in set(stored) - set(items):
+            self.delete(kind, name)
+            changed.append(f'{kind}:{name}')
+        for name, item in items.items():
+            item_signature = json.dumps(signatures[name])
+            if stored.get(name) != item_signature:
+                self.delete(kind, name)
+                write(name, item)
+                self.connection.execute(
+                    'INSERT INTO signatures VALUES (?, ?, ?)', (kind, name, item_signature))
+                changed.append(f'{kind}:{name}')
+        return changed
+
+    def delete(self, kind: str, name: str):
+        for table, column in TABLES[kind]:
+            self.connection.execute(f'DELETE FROM {table} WHERE {column} = ?', (name,))
+        self.connection.execute(
+            'DELETE FROM signatures WHERE kind = ? AND name = ?', (kind, name))
+
+    def write_batch(self, name: str, batch):
+        guids = sorted({guid for guid in batch.files if guid})
+        self.connection.execute(
+            'INSERT INTO batches VALUES (?, ?, ?)', (name, batch.name, len(guids)))
+        self.connection.executemany(
+            'INSERT INTO batch_guids VALUES (?, ?)', [(name, guid) for guid in guids])
+
+    def write_task(self, name: str, task):
+        gold_files = task.gold_file_names
+        self.connection.execute(
+            'INSERT INTO tasks VALUES (?, ?)', (name, len(gold_files)))
+        self.connection.executemany(
+            'INSERT INTO gold_files VALUES (?, ?, ?)',
+            [(name, gold_file, guid)
+             for gold_file, guid in zip(gold_files, task.gold_file_ids())])
+        self.connection.executemany(
+            'INSERT INTO data_drops VALUES (?, ?)',
+            [(name, data_drop) for data_drop in task.data_drops])
+
+    def write_evaluation(self, name: str, evaluation):
+        self.connection.execute('INSERT INTO evaluations VALUES (?)', (name,))
+
+    def write_prediction(self, key: str, prediction):
+        evaluation = key.split('/')[0]
+        self.connection.execute(
+            'INSERT INTO predictions VALUES (?, ?, ?, ?, ?)',
+            (key, evaluation, prediction.name, prediction.prediction_name,
+             prediction.prediction_batch))
+        self.connection.executemany(
+            'INSERT INTO prediction_files VALUES (?, ?, ?)',
+            [(key, file_name, Path(file_name).stem)
+             for file_name in prediction.file_names()])
+
+    def write_report(self, key: str, report):
+        evaluation = key.split('/')[0]
+        self.connection.execute(
+            'INSERT INTO reports VALUES (?, ?, ?, ?, ?)',
+            (key, evaluation, report.name, report.report_tool, report.report_batch))
+
+    def batch_predictions(self, batch: str):
+        """Return (evaluation name, prediction name) pairs for the system predictions
+        on a batch."""
+        return self.query(
+            'SELECT evaluation, name FROM predictions WHERE batch = ?'
+            ' ORDER BY evaluation, name', (batch,))
+
+    def batch_reports(self, batch: str):
+        """Return (evaluation name, report name) pairs for the reports on a batch."""
+        return self.query(
+            'SELECT evaluation, name FROM reports WHERE batch = ?'
+            ' ORDER BY evaluation, name', (batch,))
+
+    def batches_used_by(self, evaluation: str):
+        """Return the names of the batches used by predictions or reports of an
+        evaluation."""
+        rows = self.query(
+            'SELECT batch FROM predictions WHERE evaluation = ?'
+            ' UNION SELECT batch FROM reports WHERE evaluation = ? ORDER BY batch',
+            (evaluation, evaluation))
+        return [batch for (batch,) in rows]
+
+    def evaluations_using(self, batch: str):
+        """Return the names of the evaluations with predictions or reports on a
+        batch."""
+        rows = self.query(
+            'SELECT evaluation FROM predictions WHERE batch = ?'
+            ' UNION SELECT evaluation FROM reports WHERE batch = ? ORDER BY evaluation',
+            (batch, batch))
+        return [evaluation for (evaluation,) in rows]
+
+    def batch_guids(self, batch: str):
+        rows = self.query(
+            'SELECT guid FROM batch_guids WHERE batch = ? ORDER BY guid', (batch,))
+        return [guid for (guid,) in rows]
+
+    def prediction_files_with_guid(self, guid: str):
+        """Return (evaluation name, prediction name, file name) triples for all MMIF
+        files on a GUID."""
+        return self.query(
+            'SELECT p.evaluation, p.name, f.name FROM prediction_files f'
+            ' JOIN predictions p ON p.key = f.prediction WHERE f.guid = ?'
+            ' ORDER BY p.evaluation, p.name', (guid,))
+
+    def tasks_with_guid(self, guid: str):
+        """Return (task name, gold file) pairs for all gold files on a GUID."""
+        return self.query(
+            'SELECT task, name FROM gold_files WHERE guid = ? ORDER BY task, name', (guid,))
+
+    def batches_with_guid(self, guid: str):
+        rows = self.query(
+            'SELECT batch FROM batch_guids WHERE guid = ? ORDER BY batch', (guid,))
+        return [batch for (batch,) in rows]
+
+    def tasks_covering_batch(self, batch: str):
+        """Return (task name, number of GUIDs) pairs for tasks with gold files for
+        GUIDs from a batch."""
+        return self.query(
+            'SELECT g.task, COUNT(DISTINCT g.guid) FROM gold_files g'
+            ' JOIN batch_guids b ON b.guid = g.guid WHERE b.batch = ?'
+            ' GROUP BY g.task ORDER BY g.task', (batch,))
+
+    def prediction_coverage(self, batch: str):
+        """Return (evaluation name, prediction name, number of files) triples for
+        prediction batches with MMIF files for GUIDs from a batch."""
+        return self.query(
+            'SELECT p.evaluation, p.name, COUNT(*) FROM prediction_files f'
+            ' JOIN batch_guids b ON b.guid = f.guid'
+            ' JOIN predictions p ON p.key = f.prediction WHERE b.batch = ?'
+            ' GROUP BY p.key ORDER BY p.evaluation, p.name', (batch,))
+
+
+def database_path(annotations: str, evaluations: str):
+    """Return the path of the database, which is config.DATABASE if that is set and
+    otherwise a file in the cache directory named after the two repositories."""
+    if config.DATABASE is not None:
+        return config.DATABASE
+    names = f'{Path(annotations).resolve()}\n{Path(evaluations).resolve()}'
+    digest = hashlib.sha1(names.encode('utf8')).hexdigest()[:16]
+    return str(Path(config.CACHE) / f'model-{digest}.sqlite')
+
+
+
+if __name__ == '__main__':
+
+    import sys
+
+    store = Store(database_path(config.ANNOTATIONS, config.EVALUATIONS))
+    print(store)
+    for guid in sys.argv[1:]:
+        print(f'\n{guid}')
+        print('    batches     ', store.batches_with_guid(guid))
+        print('    tasks       ', store.tasks_with_guid(guid))
+        print('    predictions ', store.prediction_files_with_guid(guid))
@@ -0,0 +1,64 @@
+"""Tests for the annotation repository, run with "python -m pytest" in this directory."""
+
+import subprocess
+
+import pytest
+
+import config
+import annotation
+
+
+def guid(number: int):
+    return f'cpb-aacip-{number:04d}'
+
+
+@pytest.fixture
+def annotations(tmp_path, monkeypatch):
+    """An annotation repository with two tasks and three batches, committed to git."""
+    pytest.importorskip('git')
+    monkeypatch.setattr(config, 'CACHE', str(tmp_path / 'cache'))
+    root = tmp_path / 'annotations'
+    (root / 'batches').mkdir(parents=True)
+    (root / 'README.md').write_text('# Annotations\n')
+    for name, numbers in (('batch-1', range(0, 10)), ('batch-2', range(5, 15)),
+                          ('batch-3', range(40, 45))):
+        (root / 'batches' / f'{name}.txt').write_text(
+            f'# {name}\n' + ''.join(f'{guid(n)}\n' for n in numbers))
+    golds = root / 'task-a' / 'golds'
+    golds.mkdir(parents=True)
+    for number in range(0, 8):
+        (golds / f'{guid(number)}.csv').write_text('start,end\n')
+    (root / 'task-a' / '240101-first').mkdir()
+    (root / 'task-a' / '240101-first' / 'x.csv').write_text('x\n')
+    golds = root / 'task-b' / 'golds' / 'sub'
+    golds.mkdir(parents=True)
+    for number in range(6, 13):
+        (golds / f'{guid(number)}.tsv').write_text('label\n')
+    for command in (['init', '-q'], ['add', '.'],
+                    ['-c', 'user.name=test', '-c', 'user.email=test@example.com',
+                     'commit', '-q', '-m', 'annotations']):
+        subprocess.run(['git', *command], cwd=root, check=True)
+    return annotation.Repository(root)
+
+
+def test_refresh_reports_a_change_once(annotations):
+    assert annotations.refresh() == []
+    task = annotations.path / 'task-a'
+    (task / 'golds' / f'{guid(20)}.csv').write_text('start,end\n')
+    (task / '240601-second').mkdir()
+    (task / '240601-second' / 'y.csv').write_text('y\n')
+    assert annotations.refresh() == ['task:task-a']
+    assert annotations.refresh() == []
+    assert len(annotations.task('task-a')) == 9
+    assert sorted(annotations.task('task-a').data_drops) == ['240101-first', '240601-second']
+
+
+def test_overlaps_match_compare_to_batch(annotations):
+    assert annotations.task_names == ['task-a', 'task-b']
+    for task_name in annotations.task_names:
+        task = annotations.task(task_name)
+        for batch_name in annotations.batch_names:
+            batch = annotations.batch(batch_name)
+            assert annotations.overlaps.comparison(task_name, batch_name) \
+                == task.compare_to_batch(batch)
+    assert annotations.comparison('task-b', 'batch-2') == (7, 0, 3)
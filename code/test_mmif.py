@@ -0,0 +1,47 @@
+"""Tests for the MMIF index, run with "python -m pytest" in this directory."""
+
+import json
+
+import pytest
+
+import mmif
+
+
+def mmif_json():
+    """A MMIF object with non-ASCII text in and between the indexed arrays."""
+    return {
+        'metadata': { 'mmif': 'http://mmif.clams.ai/1.0.0', 'note': 'é' * 50 },
+        'documents': [
+            { '@type': 'TextDocument', 'properties': { 'id': f'd{i}', 'text': 'café ' * i } }
+            for i in range(20) ],
+        'views': [
+            { 'id': f'v{v}',
+              'metadata': { 'app': 'ünïcödé' * (v + 1), 'contains': {} },
+              'annotations': [
+                  { '@type': 'TimeFrame' if i % 2 else 'Token',
+                    'properties': { 'id': f'a{i}', 'label': 'naïve' * (i % 5) } }
+                  for i in range(30) ] }
+            for v in range(3) ] }
+
+
+@pytest.mark.parametrize('window_size', [16, mmif.WINDOW_SIZE])
+def test_round_trip(tmp_path, monkeypatch, window_size):
+    monkeypatch.setattr(mmif, 'WINDOW_SIZE', window_size)
+    expected = mmif_json()
+    path = tmp_path / 'test.mmif'
+    path.write_text(json.dumps(expected, indent=2, ensure_ascii=False), encoding='utf8')
+    mmif_file = mmif.MmifFile(path, cache=False)
+    assert mmif_file.metadata == expected['metadata']
+    assert mmif_file.documents(0, 100) == expected['documents']
+    assert mmif_file.view_count == len(expected['views'])
+    for number, view in enumerate(expected['views']):
+        assert mmif_file.view_info(number)['metadata'] == view['metadata']
+        assert mmif_file.annotations(number, 0, 100) == view['annotations']
+
+
+@pytest.mark.parametrize('content', [',"x"', '}', ']', ':{}', '{"a": [1, 2'])
+def test_broken_file(tmp_path, content):
+    path = tmp_path / 'broken.mmif'
+    path.write_text(content)
+    with pytest.raises(ValueError):
+        mmif.MmifFile(path, cache=False)
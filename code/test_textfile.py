@@ -0,0 +1,57 @@
+"""Tests for paged text files, run with "python -m pytest" in this directory."""
+
+import sys
+import json
+from collections import OrderedDict
+
+import config
+import utils
+import textfile
+
+
+class Blob(utils.GitPath):
+
+    """Stands in for a file in a git tree, only the name and the content are used."""
+
+    def __init__(self, name: str, data: bytes):
+        self._name = name
+        self._data = data
+
+    def read_bytes(self):
+        return self._data
+
+
+def test_line_index_cache_budget(monkeypatch):
+    monkeypatch.setattr(utils, 'file_key', lambda path: ('git', path._name))
+    monkeypatch.setattr(config, 'LINE_INDEX_CACHE_SIZE', 1024 * 1024)
+    monkeypatch.setattr(textfile, '_cache', OrderedDict())
+    monkeypatch.setattr(textfile, '_cache_size', 0)
+    blobs = [Blob(f'gold-{i}.txt', (f'line {i}\n' * 50000).encode()) for i in range(10)]
+    indexes = [textfile.get_index(blob) for blob in blobs]
+    assert sys.getsizeof(indexes[0]) > len(blobs[0].read_bytes())
+    assert textfile._cache_size <= 1024 * 1024
+    assert 0 < len(textfile._cache) < len(blobs)
+    assert textfile.get_index(blobs[-1]) is indexes[-1]
+    assert textfile.get_index(blobs[0]) is not indexes[0]
+    assert textfile.PagedFile(blobs[-1], page_size=2).lines(0, 2) == ['line 9', 'line 9']
+
+
+def test_one_line_json_pages(tmp_path):
+    value = [{ 'id': i, 'label': f'label {i}', 'span': [i, i + 10] } for i in range(2000)]
+    path = tmp_path / 'drop.json'
+    path.write_text(json.dumps(value))
+    assert len(textfile.PagedFile(path)) == 1
+    paged = textfile.PagedFile(path, page_size=100, pretty=True)
+    assert paged.page_count > 100
+    pages = [paged.page(number) for number in range(paged.page_count)]
+    assert all(page.count('\n') < 100 for page in pages)
+    assert '\n'.join(pages) == json.dumps(value, indent=2)
+
+
+def test_page_bytes(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'FILE_PAGE_BYTES', 1000)
+    path = tmp_path / 'long.txt'
+    path.write_text('é' * 5000 + '\nshort\n')
+    page = textfile.PagedFile(path).page(0)
+    assert page.startswith('é' * 500) and len(page.encode('utf8')) < 1100
+    assert 'not shown' in page
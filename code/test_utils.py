@@ -0,0 +1,87 @@
+"""Tests for the utilities, run with "python -m pytest" in this directory."""
+
+import gc
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import utils
+import config
+import annotation
+
+
+@pytest.fixture
+def repository(tmp_path):
+    """A git repository with a commit that has a few hundred gold files."""
+    golds = tmp_path / 'task' / 'golds'
+    golds.mkdir(parents=True)
+    for i in range(300):
+        (golds / f'cpb-aacip-{i:04d}.txt').write_text(f'gold file {i}\n' * 200)
+    for command in (['init', '-q'], ['add', '.'],
+                    ['-c', 'user.name=test', '-c', 'user.email=test@example.com',
+                     'commit', '-q', '-m', 'golds']):
+        subprocess.run(['git', *command], cwd=tmp_path, check=True)
+    git = pytest.importorskip('git')
+    return git.Repo(tmp_path)
+
+
+@pytest.fixture
+def annotations(repository, tmp_path, monkeypatch):
+    """The annotation repository in the git repository, with a few branches."""
+    monkeypatch.setattr(config, 'CACHE', str(tmp_path / 'cache'))
+    (tmp_path / 'batches').mkdir()
+    (tmp_path / 'batches' / 'batch-1.txt').write_text('cpb-aacip-0001\n')
+    subprocess.run(['git', 'add', '.'], cwd=tmp_path, check=True)
+    subprocess.run(['git', '-c', 'user.name=test', '-c', 'user.email=test@example.com',
+                    'commit', '-q', '-m', 'batch'], cwd=tmp_path, check=True)
+    for number in range(4):
+        subprocess.run(['git', 'branch', f'branch-{number}'], cwd=tmp_path, check=True)
+    return annotation.Repository(tmp_path)
+
+
+def test_git_path_concurrent_reads(repository):
+    # a fresh root so that threads also race on looking up trees
+    golds = utils.GitPath(repository.head.commit.tree) / 'task' / 'golds'
+    paths = [golds / f'cpb-aacip-{i:04d}.txt' for i in range(300)]
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        listing = executor.submit(lambda: sorted(p.name for p in golds.iterdir()))
+        futures = [executor.submit(path.read_text) for path in paths]
+        contents = [future.result(timeout=60) for future in futures]
+        assert listing.result(timeout=60) == sorted(p.name for p in paths)
+    assert contents == [f'gold file {i}\n' * 200 for i in range(300)]
+
+
+def test_snapshot_concurrent(annotations):
+    names = annotations.branch_names
+    def snapshots():
+        return [annotations.snapshot(name).commit.hexsha for _ in range(50) for name in names]
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        futures = [executor.submit(snapshots) for _ in range(8)]
+        results = [future.result(timeout=60) for future in futures]
+    assert all(result == results[0] for result in results)
+    assert len(set(results[0])) == 1
+
+
+def test_worktree_pool_keeps_used_worktrees(annotations, tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'WORKTREES', True)
+    monkeypatch.setattr(config, 'WORKTREE_POOL_SIZE', 1)
+    (tmp_path / 'batches' / 'batch-2.txt').write_text('cpb-aacip-0002\n')
+    for command in (['checkout', '-q', '-b', 'other'], ['add', '.'],
+                    ['-c', 'user.name=test', '-c', 'user.email=test@example.com',
+                     'commit', '-q', '-m', 'batch 2'], ['checkout', '-q', 'branch-0']):
+        subprocess.run(['git', *command], cwd=tmp_path, check=True)
+    annotations.load_branches()
+    first = annotations.at_branch('branch-0')
+    second = annotations.at_branch('other')
+    assert second.batch_names == ['batch-1', 'batch-2']
+    # the first worktree was dropped from the pool but is still in use
+    assert len(annotations._worktrees) == 1
+    assert first.path.is_dir()
+    assert annotations.at_branch('branch-0') is first
+    path = first.path
+    del first
+    annotations.at_branch('other')
+    gc.collect()
+    annotations.at_branch('other')
+    assert not path.is_dir()
@@ -0,0 +1,199 @@
+"""Paged access to text files
+
+Gold files and data drop files can be large, and reading one in full and handing
+all of it to Streamlit freezes both the server and the browser. The LineIndex
+class scans a memory-mapped file once and keeps the byte offsets of all lines,
+after that any page of lines is one slice of the file. Indexes are cached on the
+size and modification time of the file, in a cache with a budget in bytes.
+
+A JSON file is often all on one line, which would make it one page however big
+it is. Files with no more lines than fit on a page are pretty-printed as a whole
+when asked for and then paged over the lines of the pretty-printed text, and no
+page shows more than config.FILE_PAGE_BYTES.
+
+"""
+
+import sys
+import json
+import mmap
+import threading
+from array import array
+from pathlib import Path
+from collections import OrderedDict
+
+import config
+import utils
+import render
+import timing
+
+
+# line indexes with their sizes, the size of an index includes the content of a
+# file from git, which is kept with the index
+_cache = OrderedDict()
+_cache_size = 0
+_cache_lock = threading.Lock()
+
+
+class LineIndex:
+
+    """Byte offsets of the lines in a file. A file in a git tree cannot be mapped,
+    so for a GitPath the content of the blob is kept with the offsets, and so is
+    the text handed in as data, which is then indexed instead of the file."""
+
+    def __init__(self, path: Path, data: bytes = None):
+        self.path = path
+        self.data = None
+        # offsets of the start of each line followed by the size of the file, so
+        # line n is the bytes from starts[n] up to starts[n + 1]
+        self.starts = array('q', [0])
+        if data is not None or isinstance(path, utils.GitPath):
+            self.data = path.read_bytes() if data is None else data
+            self.size = len(self.data)
+            self.scan(self.data)
+        else:
+            self.size = path.stat().st_size
+            if self.size:
+                with self.map() as data:
+                    self.scan(data)
+
+    def __len__(self):
+        return len(self.starts) - 1
+
+    def __sizeof__(self):
+        data = 0 if self.data is None else sys.getsizeof(self.data)
+        return object.__sizeof__(self) + sys.getsizeof(self.starts) + data
+
+    def map(self):
+        with open(self.path, 'rb') as fh:
+            return mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def scan(self, data):
+        starts = self.starts
+        find = data.find
+        position = find(b'\n')
+        while position != -1:
+            starts.append(position + 1)
+            position = find(b'\n', position + 1)
+        if starts[-1] != self.size:
+            starts.append(self.size)
+
+    def read(self, first: int, last: int):
+        """Return the bytes of the lines from first up to but not including last."""
+        start = self.starts[first]
+        end = self.starts[last]
+        timing.add_bytes(end - start)
+        if self.data is not None:
+            return self.data[start:end]
+        with self.map() as data:
+            return data[start:end]
+
+
+class PagedFile:
+
+    """Pages of lines from a text file, a page is read without reading anything
+    else from the file. With pretty set lines that are JSON values are printed
+    with indentation, which is what you want for JSON files that are all on one
+    line and for JSON Lines."""
+
+    def __init__(self, path: Path, page_size: int = config.FILE_PAGE_SIZE,
+                 pretty: bool = False):
+        self.path = path
+        self.page_size = page_size
+        self.pretty = pretty
+        self.index = get_index(path)
+        # the lines of the file, or of the whole file pretty-printed if it does
+        # not have more lines than a page, then lines are not printed again
+        self.lines_index = self.index
+        if pretty and len(self.index) <= page_size:
+            self.lines_index = get_index(path, pretty=True)
+            self.pretty = False
+
+    def __len__(self):
+        return len(self.lines_index)
+
+    def __str__(self):
+        return f'<{self.__class__.__name__} {self.path.name} lines={len(self)}>'
+
+    @property
+    def page_count(self):
+        return max(1, (len(self) + self.page_size - 1) // self.page_size)
+
+    def lines(self, offset: int = 0, count: int = 10):
+        end = min(offset + count, len(self))
+        if offset >= end:
+            return []
+        text = self.lines_index.read(offset, end).decode('utf8', errors='replace')
+        return [line.rstrip('\r') for line in text.split('\n')[:end - offset]]
+
+    def page(self, number: int):
+        """Return the text of a page, where the first page is page 0. Pages are kept
+        in the render cache."""
+        def render_page():
+            lines = self.lines(number * self.page_size, self.page_size)
+            if self.pretty:
+                lines = [pretty_json(line) for line in lines]
+            return cut_off('\n'.join(lines))
+        how = ('page', self.page_size, number, self.lines_index is not self.index, self.pretty)
+        return render.cached(self.path, how, render_page)
+
+
+def pretty_json(line: str):
+    try:
+        return json.dumps(json.loads(line), indent=2)
+    except ValueError:
+        return line
+
+
+def pretty_bytes(path: Path):
+    """Return the content of a file with all lines that are JSON values printed
+    with indentation."""
+    index = get_index(path)
+    text = index.read(0, len(index)).decode('utf8', errors='replace')
+    return '\n'.join(pretty_json(line.rstrip('\r')) for line in text.split('\n')).encode('utf8')
+
+
+def cut_off(text: str, size: int = None):
+    """Return the text cut off at a number of bytes, config.FILE_PAGE_BYTES if no
+    size is given, with a note on how much was left out."""
+    size = config.FILE_PAGE_BYTES if size is None else size
+    data = text.encode('utf8')
+    if len(data) <= size:
+        return text
+    rest = utils.human_size(len(data) - size)
+    return (data[:size].decode('utf8', errors='ignore')
+            + f'\n\n[{rest} more on this page not shown]')
+
+
+@timing.timed('textfile.get_index')
+def get_index(path: Path, pretty: bool = False):
+    """Return the index for a file, using a cached index if the size and the
+    modification time of the file did not change. Files from git are cached on
+    the SHA of the blob. With pretty set this indexes the file as pretty-printed
+    by pretty_bytes()."""
+    global _cache_size
+    key = utils.file_key(path) + (('pretty',) if pretty else ())
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key][0]
+    index = LineIndex(path, pretty_bytes(path)) if pretty else LineIndex(path)
+    size = sys.getsizeof(index)
+    if size > config.LINE_INDEX_CACHE_SIZE:
+        return index
+    with _cache_lock:
+        if key in _cache:
+            _cache_size -= _cache.pop(key)[1]
+        _cache[key] = (index, size)
+        _cache_size += size
+        while _cache_size > config.LINE_INDEX_CACHE_SIZE:
+            _, (_, evicted) = _cache.popitem(last=False)
+            _cache_size -= evicted
+    return index
+
+
+
+if __name__ == '__main__':
+
+    paged = PagedFile(Path(sys.argv[1]))
+    print(paged)
+    print(paged.page(0))
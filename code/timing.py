@@ -0,0 +1,164 @@
+"""Timing instrumentation
+
+Records wall time, bytes read and object counts for operations on the hot
+paths of the dashboard, grouped by Streamlit rerun. The recorder is shared by
+all sessions, each rerun runs in its own thread and operations are added to the
+rerun of the current thread. Operations that happen outside of a rerun, for
+example when the model is loaded at startup, go into a rerun named "startup".
+
+Use the timer() context manager or the timed() decorator:
+
+    with timing.timer('annotation viewer: tasks tab'):
+        ...
+
+    @timing.timed('annotations.load')
+    def load(self):
+        ...
+
+"""
+
+import time
+import json
+import functools
+import threading
+from collections import deque, defaultdict
+from contextlib import contextmanager
+
+
+# Number of reruns kept in memory and number of operations kept for each rerun.
+MAX_RERUNS = 100
+MAX_OPERATIONS = 1000
+
+
+class Rerun:
+
+    def __init__(self, label: str):
+        self.label = label
+        self.start = time.time()
+        self.seconds = None
+        self.operations = []
+
+    def as_dict(self):
+        return {
+            'label': self.label,
+            'start': self.start,
+            'seconds': self.seconds,
+            'bytes': sum(op['bytes'] for op in self.operations if op['depth'] == 0),
+            'objects': sum(op['objects'] for op in self.operations),
+            'operations': self.operations }
+
+
+class Recorder:
+
+    def __init__(self, max_reruns: int = MAX_RERUNS):
+        self.reruns = deque(maxlen=max_reruns)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    @property
+    def current(self):
+        """Return the rerun for the current thread, starting one if there is none."""
+        rerun = getattr(self._local, 'rerun', None)
+        if rerun is None:
+            rerun = self.start_rerun('startup')
+        return rerun
+
+    @property
+    def stack(self):
+        """The operations that are running in the current thread, innermost last."""
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    def start_rerun(self, label: str):
+        rerun = Rerun(label)
+        self._local.rerun = rerun
+        self._local.stack = []
+        with self._lock:
+            self.reruns.append(rerun)
+        return rerun
+
+    def end_rerun(self):
+        rerun = getattr(self._local, 'rerun', None)
+        if rerun is not None:
+            rerun.seconds = time.time() - rerun.start
+            self._local.rerun = None
+
+    def add_bytes(self, count: int):
+        """Add bytes read to all running operations in the current thread."""
+        for operation in self.stack:
+            operation['bytes'] += count
+
+    def add_objects(self, count: int):
+        if self.stack:
+            self.stack[-1]['objects'] += count
+
+    def recent(self):
+        with self._lock:
+            return [rerun.as_dict() for rerun in self.reruns]
+
+    def slowest(self, count: int = 20):
+        """Return the operations with the highest maximum time over all recorded
+        reruns, with their number of calls and total time."""
+        totals = defaultdict(lambda: {'calls': 0, 'seconds': 0.0, 'max': 0.0, 'bytes': 0})
+        for rerun in self.recent():
+            for operation in rerun['operations']:
+                total = totals[operation['name']]
+                total['calls'] += 1
+                total['seconds'] += operation['seconds']
+                total['bytes'] += operation['bytes']
+                total['max'] = max(total['max'], operation['seconds'])
+        rows = [dict(total, name=name) for name, total in totals.items()]
+        return sorted(rows, key=lambda row: -row['max'])[:count]
+
+    def to_json(self):
+        return json.dumps({'reruns': self.recent(), 'slowest': self.slowest()}, indent=2)
+
+
+RECORDER = Recorder()
+
+
+@contextmanager
+def timer(name: str):
+    """Time the code in the with statement and record it as an operation of the
+    current rerun. The operation dictionary is handed to the with statement so
+    the code can add object counts to it."""
+    rerun = RECORDER.current
+    stack = RECORDER.stack
+    operation = {'name': name, 'depth': len(stack), 'seconds': 0.0, 'bytes': 0, 'objects': 0}
+    stack.append(operation)
+    start = time.perf_counter()
+    try:
+        yield operation
+    finally:
+        operation['seconds'] = time.perf_counter() - start
+        stack.pop()
+        if len(rerun.operations) < MAX_OPERATIONS:
+            rerun.operations.append(operation)
+
+
+def timed(name: str):
+    """Decorator version of timer()."""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with timer(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def start_rerun(label: str = ''):
+    return RECORDER.start_rerun(label)
+
+
+def end_rerun():
+    RECORDER.end_rerun()
+
+
+def add_bytes(count: int):
+    RECORDER.add_bytes(count)
+
+
+def add_objects(count: int):
+    RECORDER.add_objects(count)
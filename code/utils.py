@@ -1,8 +1,23 @@
 import os
+import sys
 import json
+import gzip
+import bisect
+import weakref
+import threading
+from array import array
+from io import StringIO
 from pathlib import Path
 from random import choice
 from string import ascii_uppercase
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import config
+import mmif
+import timing
+import render
+import textfile
 
 # import pandas as pd
 # import streamlit as st
@@ -12,7 +27,11 @@ from string import ascii_uppercase
 class FileSystemNode:
 
     """Abstract class which provides some intialization, sorting and other common
-    functionality for path-like classes from the annotation and evaluation modules."""
+    functionality for path-like classes from the annotation and evaluation modules.
+    Subclasses define __slots__ as well, there can be many thousands of them and
+    the model is kept in memory for as long as the dashboard runs."""
+
+    __slots__ = ('name', 'path')
 
     def __init__(self, path: Path):
         self.name = path.name
@@ -28,60 +47,650 @@ class FileSystemNode:
         return f'<{self.__class__.__name__} {self.name}>'
 
 
-def st_list_files(component, header: str, file_names: list, cutoff: int = 5):
-    """Display a list of file names in a Streamlit component, returns a selectbox
-    or a list of radio buttons, depending on how long the list is."""
-    file_names = list(file_names)
-    if len(file_names) > cutoff:
-        return component.selectbox(
-            header, file_names, label_visibility='collapsed')
-    else:
-        return component.radio(
-            header, file_names, label_visibility='collapsed', format_func=identity)
-
-
-def st_list_files2(component, task, cutoff: int = 5):
-    """Display a list of file names in a Streamlit component, returns a selectbox
-    or a list of radio buttons, depending on how long the list is. The difference
-    with st_list_files() is that less assumptions are made on the golds directory
-    structure."""
-    # TODO: having these two functions is confusing, clean this up
-    amended_fnames = []
-    # using this to determine what part of the path is needed
-    dir_parts = task.gold_directory.parts
-    for fname in task.gold_files:
-        amended_fnames.append(os.sep.join(fname.parts[len(dir_parts):]))
-    if len(amended_fnames) > cutoff:
+class GitPath:
+
+    """A read-only stand-in for pathlib.Path on top of a git tree object. It has
+    just enough of the Path interface for the annotation classes to be built from
+    a commit without touching the working tree. Objects are looked up lazily, so
+    creating a path is free and only listing or reading it goes to git."""
+
+    __slots__ = ('tree', 'parts', '_objects')
+
+    def __init__(self, tree, parts: tuple = (), objects: dict = None):
+        # The tree is the root tree of a commit, parts is the path inside of it.
+        # Objects are cached in a dictionary shared by all paths from the same
+        # root, since GitPython reads a tree again each time it is looked up.
+        self.tree = tree
+        self.parts = tuple(parts)
+        self._objects = { (): tree } if objects is None else objects
+
+    def __truediv__(self, name):
+        return GitPath(self.tree, self.parts + tuple(Path(name).parts), self._objects)
+
+    def __eq__(self, other):
+        return (isinstance(other, GitPath)
+                and self.tree.binsha == other.tree.binsha and self.parts == other.parts)
+
+    def __lt__(self, other):
+        return self.parts < other.parts
+
+    def __hash__(self):
+        return hash((self.tree.binsha, self.parts))
+
+    def __str__(self):
+        return '/'.join(self.parts)
+
+    def __repr__(self):
+        return f'<GitPath {self.tree.hexsha[:8]}:{self}>'
+
+    @property
+    def name(self):
+        return self.parts[-1] if self.parts else ''
+
+    @property
+    def stem(self):
+        return Path(self.name).stem
+
+    @property
+    def suffix(self):
+        return Path(self.name).suffix
+
+    @property
+    def lock(self):
+        return git_lock(self.tree.repo)
+
+    @property
+    def object(self):
+        """Return the git object at the path or None if there is no such object."""
+        if self.parts not in self._objects:
+            # reading a tree goes through the cat-file process of the repository
+            with self.lock:
+                parent = GitPath(self.tree, self.parts[:-1], self._objects).object
+                obj = None
+                if parent is not None and parent.type == 'tree':
+                    try:
+                        obj = parent[self.parts[-1]]
+                    except KeyError:
+                        pass
+                self._objects[self.parts] = obj
+        return self._objects[self.parts]
+
+    @property
+    def hexsha(self):
+        obj = self.object
+        return None if obj is None else obj.hexsha
+
+    def exists(self):
+        return self.object is not None
+
+    def is_dir(self):
+        obj = self.object
+        return obj is not None and obj.type == 'tree'
+
+    def is_file(self):
+        obj = self.object
+        return obj is not None and obj.type == 'blob'
+
+    def iterdir(self):
+        obj = self.object
+        if obj is None or obj.type != 'tree':
+            raise NotADirectoryError(str(self))
+        with self.lock:
+            children = list(obj)
+        for child in children:
+            parts = self.parts + (child.name,)
+            self._objects[parts] = child
+            yield GitPath(self.tree, parts, self._objects)
+
+    def read_bytes(self):
+        obj = self.object
+        if obj is None or obj.type != 'blob':
+            raise FileNotFoundError(str(self))
+        with self.lock:
+            return obj.data_stream.read()
+
+    def read_text(self):
+        return self.read_bytes().decode('utf8')
+
+    def open(self):
+        return StringIO(self.read_text())
+
+
+# Locks for GitPython repositories, see git_lock().
+_git_locks = weakref.WeakKeyDictionary()
+_git_locks_lock = threading.Lock()
+
+
+def git_lock(repo):
+    """Return the lock for a GitPython repository. A Repo reads all objects through
+    one git-cat-file process, which hangs when threads use it at the same time, so
+    every read of trees and blobs by a GitPath holds this lock. It is reentrant
+    because looking up an object looks up its parent first."""
+    with _git_locks_lock:
+        lock = _git_locks.get(repo)
+        if lock is None:
+            lock = _git_locks[repo] = threading.RLock()
+        return lock
+
+
+class TreeDirectory:
+
+    """A directory in a DirectoryTree, with the sizes of the files in it and the
+    number of files and total size of everything below it."""
+
+    __slots__ = ('parts', 'files', 'subdirectories', 'file_count', 'size')
+
+    def __init__(self, parts: tuple):
+        self.parts = parts
+        self.files = {}
+        self.subdirectories = {}
+        self.file_count = 0
+        self.size = 0
+
+    @property
+    def name(self):
+        return self.parts[-1] if self.parts else ''
+
+    @property
+    def entries(self):
+        """All file and directory names in the directory, sorted."""
+        return sorted(list(self.files) + list(self.subdirectories))
+
+    def add_totals(self):
+        """Set the file counts and sizes from those of the files and directories."""
+        for subdirectory in self.subdirectories.values():
+            subdirectory.add_totals()
+        self.file_count = len(self.files) + sum(
+            d.file_count for d in self.subdirectories.values())
+        self.size = sum(self.files.values()) + sum(
+            d.size for d in self.subdirectories.values())
+
+
+class DirectoryTree:
+
+    """An index of all files and directories under a path, made with a single walk
+    over the directory with os.scandir or a single git-ls-tree for a GitPath."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.root = TreeDirectory(())
+        if isinstance(path, GitPath):
+            self.read_git_tree()
+        elif path.is_dir():
+            self.read_directory(path, self.root)
+        self.root.add_totals()
+
+    def read_directory(self, path: Path, directory: TreeDirectory):
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    subdirectory = TreeDirectory(directory.parts + (entry.name,))
+                    directory.subdirectories[entry.name] = subdirectory
+                    self.read_directory(entry.path, subdirectory)
+                else:
+                    directory.files[entry.name] = entry.stat().st_size
+
+    def read_git_tree(self):
+        obj = self.path.object
+        if obj is None or obj.type != 'tree':
+            return
+        # each line is "<mode> <type> <sha> <size>\t<path>" and the size is "-" for trees
+        listing = obj.repo.git.ls_tree('-r', '-t', '-l', '-z', obj.hexsha)
+        for line in listing.split('\0'):
+            if not line:
+                continue
+            info, path = line.split('\t', 1)
+            _, object_type, _, size = info.split()
+            parts = tuple(path.split('/'))
+            directory = self.directory(parts[:-1])
+            if object_type == 'tree':
+                directory.subdirectories[parts[-1]] = TreeDirectory(parts)
+            else:
+                directory.files[parts[-1]] = int(size)
+
+    def directory(self, parts: tuple = ()):
+        """Return the TreeDirectory for a path relative to the root."""
+        directory = self.root
+        for part in parts:
+            directory = directory.subdirectories[part]
+        return directory
+
+    def paths(self, parts: tuple = ()):
+        """Return the paths for all entries in a directory."""
+        base = self.path
+        for part in parts:
+            base = base / part
+        return [base / name for name in self.directory(parts).entries]
+
+    def lines(self, expanded: set, max_files: int = 100):
+        """Return lines that print the tree, where only directories in the expanded
+        set are opened and at most max_files files are listed for a directory."""
+        root = self.root
+        lines = [f'{self.path.name}/  ({root.file_count} files, {human_size(root.size)})']
+        self._add_lines(self.root, expanded, max_files, '', lines)
+        return lines
+
+    def _add_lines(self, directory: TreeDirectory, expanded: set, max_files: int,
+                   prefix: str, lines: list):
+        if directory.parts and directory.parts not in expanded:
+            return
+        names = directory.entries
+        shown_files = 0
+        for i, name in enumerate(names):
+            last = i == len(names) - 1
+            branch = '└── ' if last else '├── '
+            if name in directory.subdirectories:
+                subdirectory = directory.subdirectories[name]
+                marker = '' if subdirectory.parts in expanded else ' +'
+                lines.append(
+                    f'{prefix}{branch}{name}/  ({subdirectory.file_count} files,'
+                    f' {human_size(subdirectory.size)}){marker}')
+                self._add_lines(subdirectory, expanded, max_files,
+                                prefix + ('    ' if last else '│   '), lines)
+            else:
+                shown_files += 1
+                if shown_files <= max_files:
+                    lines.append(f'{prefix}{branch}{name}')
+                elif shown_files == max_files + 1:
+                    hidden = len(directory.files) - max_files
+                    lines.append(f'{prefix}{branch}... {hidden} more files')
+
+
+class GuidIndex:
+
+    """Dictionary encoding of GUIDs. Each GUID is given an integer identifier and
+    a set of GUIDs can be turned into a bitset, which is a Python integer where bit
+    n is set if the GUID with identifier n is in the set. Intersections and counts
+    on bitsets are much faster than on sets of strings."""
+
+    def __init__(self):
+        self.ids = {}
+        self.guids = []
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.guids)
+
+    def id(self, guid: str):
+        identifier = self.ids.get(guid)
+        if identifier is None:
+            with self._lock:
+                identifier = self.ids.get(guid)
+                if identifier is None:
+                    guid = sys.intern(guid)
+                    identifier = len(self.guids)
+                    self.guids.append(guid)
+                    self.ids[guid] = identifier
+        return identifier
+
+    def identifiers(self, guids):
+        """Return the identifiers for a list of GUIDs as a compact array."""
+        return array('I', [self.id(guid) for guid in guids])
+
+    def strings(self, identifiers):
+        """Return the GUIDs for a list of identifiers."""
+        return [self.guids[identifier] for identifier in identifiers]
+
+    def bitset(self, guids):
+        identifiers = [self.id(guid) for guid in guids]
+        if not identifiers:
+            return 0
+        bits = bytearray(max(identifiers) // 8 + 1)
+        for identifier in identifiers:
+            bits[identifier >> 3] |= 1 << (identifier & 7)
+        return int.from_bytes(bits, 'little')
+
+    def members(self, bitset: int):
+        """Return the GUIDs in a bitset, in the order of their identifiers."""
+        guids = []
+        identifier = 0
+        while bitset:
+            if bitset & 0xffffffff:
+                for i in range(32):
+                    if bitset & (1 << i):
+                        guids.append(self.guids[identifier + i])
+            bitset >>= 32
+            identifier += 32
+        return guids
+
+
+# All bitsets are made with this index so they can be compared across repositories
+GUIDS = GuidIndex()
+
+
+class FileListing:
+
+    """File names sorted without regard to case, with the range of names that start
+    with a prefix found by a binary search."""
+
+    __slots__ = ('names', 'keys')
+
+    def __init__(self, file_names):
+        self.names = sorted(file_names, key=str.lower)
+        self.keys = [name.lower() for name in self.names]
+
+    def __len__(self):
+        return len(self.names)
+
+    def range(self, prefix: str = ''):
+        """Return the first and last position of the names that start with prefix."""
+        prefix = prefix.lower()
+        first = bisect.bisect_left(self.keys, prefix)
+        last = bisect.bisect_right(self.keys, prefix + '\U0010ffff', first)
+        return first, last
+
+    def matches(self, prefix: str = '', offset: int = 0, count: int = None):
+        first, last = self.range(prefix)
+        end = last if count is None else min(last, first + offset + count)
+        return self.names[first + offset:end]
+
+
+# Listings made by get_listing(), indexed on the id of the tuple of names and with
+# the tuple itself so the id cannot be reused while the listing is cached.
+_listings = OrderedDict()
+_listings_lock = threading.Lock()
+
+
+def get_listing(file_names):
+    """Return the sorted listing for file names. Tuples of names are what the model
+    hands out for gold files, data drops and predictions, these are not changed
+    after they are made and their listing is made only once. For anything else a
+    new listing is made each time."""
+    if not isinstance(file_names, tuple):
+        return FileListing(file_names)
+    with _listings_lock:
+        entry = _listings.get(id(file_names))
+        if entry is not None and entry[0] is file_names:
+            _listings.move_to_end(id(file_names))
+            return entry[1]
+    listing = FileListing(file_names)
+    with _listings_lock:
+        _listings[id(file_names)] = (file_names, listing)
+        while len(_listings) > config.LISTING_CACHE_SIZE:
+            _listings.popitem(last=False)
+    return listing
+
+
+def popcount(bitset: int):
+    return bitset.bit_count() if hasattr(bitset, 'bit_count') else bin(bitset).count('1')
+
+
+@timing.timed('utils.st_pick_file')
+def st_pick_file(component, key: str, file_names, cutoff: int = 5,
+                 page_size: int = config.PICKER_PAGE_SIZE):
+    """Let the user pick a file name and return it, or None if there is nothing to
+    pick. Only one page of names is handed to the widget, a radio list if it has
+    no more than cutoff names and a selectbox otherwise. Long listings can be
+    filtered on a prefix of the name and paged through, and the sorted listing is
+    kept between reruns, so the cost of this does not depend on the number of
+    files. The key is used for the widget keys and should name the listing."""
+    listing = get_listing(file_names)
+    prefix = ''
+    if len(listing) > page_size:
+        prefix = component.text_input(
+            'Filter on the start of the file name', key=f'{key}-prefix')
+    first, last = listing.range(prefix)
+    if first == last:
+        component.caption(f'No file names start with "{prefix}"' if prefix else 'No files')
+        return None
+    pages = (last - first + page_size - 1) // page_size
+    offset = 0
+    if pages > 1:
+        page = component.number_input(
+            f'Page (of {pages})', min_value=1, max_value=pages, value=1,
+            key=f'{key}-page-{prefix}')
+        offset = (page - 1) * page_size
+        component.caption(
+            f'Showing {offset + 1}-{min(offset + page_size, last - first)}'
+            + f' of {last - first} files')
+    names = listing.matches(prefix, offset, page_size)
+    if len(names) > cutoff:
         return component.selectbox(
-            'file-list', amended_fnames, label_visibility='collapsed')
+            key, names, label_visibility='collapsed', key=f'{key}-file')
+    return component.radio(
+        key, names, label_visibility='collapsed', format_func=identity, key=f'{key}-file')
+
+
+@timing.timed('utils.st_display_mmif')
+def st_display_mmif(component, path: Path, page_size: int = config.PAGE_SIZE):
+    """Display a MMIF file one part at a time. The metadata, a page of documents or
+    a page of annotations from a view are shown, and only those are read from disk,
+    so this works for files of any size."""
+    try:
+        mmif_file = mmif.MmifFile(path)
+    except ValueError as e:
+        component.error(f'Cannot read MMIF file: {e}')
+        return
+    component.markdown(
+        f'*{mmif_file.document_count} documents and {mmif_file.view_count} views*')
+    parts = ['metadata', 'documents'] + list(range(mmif_file.view_count))
+    infos = [mmif_file.view_info(i) for i in range(mmif_file.view_count)]
+    def part_name(part):
+        if isinstance(part, str):
+            return part
+        info = infos[part]
+        app = (info['metadata'] or {}).get('app', '')
+        return f"view {info['id']} - {app} - {info['annotations']} annotations"
+    part = component.selectbox(
+        'mmif-part', parts, format_func=part_name, key=f'mmif-part-{path}',
+        label_visibility='collapsed')
+    if part == 'metadata':
+        component.text(
+            render.cached(path, ('mmif', 'metadata'),
+                          lambda: json.dumps(mmif_file.metadata, indent=2)))
+        return
+    if part == 'documents':
+        total = mmif_file.document_count
     else:
-        return component.radio(
-            'file-list', amended_fnames, label_visibility='collapsed', format_func=identity)
+        component.text(
+            render.cached(path, ('mmif', part, 'metadata'),
+                          lambda: json.dumps(infos[part]['metadata'], indent=2)))
+        total = infos[part]['annotations']
+    pages = max(1, (total + page_size - 1) // page_size)
+    page = component.number_input(
+        f'Page (of {pages})', min_value=1, max_value=pages, value=1,
+        key=f'mmif-page-{path}-{part}')
+    offset = (page - 1) * page_size
+    def page_text():
+        if part == 'documents':
+            items = mmif_file.documents(offset, page_size)
+        else:
+            items = mmif_file.annotations(part, offset, page_size)
+        return json.dumps(items, indent=2)
+    shown = min(page_size, total - offset)
+    component.markdown(f'*Showing {offset + 1}-{offset + shown} of {total}*')
+    component.text(render.cached(path, ('mmif', part, offset, page_size), page_text))
 
 
-def st_display_file(component, path: Path):
-    """Display the content of a file path to a Streamlit component."""
-    content = read_file(path)
-    if path.name.endswith('.mmif') or path.name.endswith('.json'):
-        content = json.dumps(json.loads(content), indent=2)
-    component.text(content)
+@timing.timed('utils.st_display_lines')
+def st_display_lines(component, path: Path, page_size: int = config.FILE_PAGE_SIZE):
+    """Display a text file one page of lines at a time. Only the lines on the page
+    are read, the offsets of the lines are indexed once and then cached. Lines in
+    JSON files can be pretty-printed, see textfile.PagedFile."""
+    pretty = False
+    if path.suffix == '.json':
+        pretty = component.toggle('Pretty-print JSON', value=True, key=f'pretty-{path!r}')
+    paged = textfile.PagedFile(path, page_size, pretty)
+    component.markdown(f'*{len(paged.index):,} lines, {human_size(paged.index.size)}*')
+    pages = paged.page_count
+    page = component.number_input(
+        f'Page (of {pages})', min_value=1, max_value=pages, value=1,
+        key=f'lines-page-{path!r}')
+    component.text(paged.page(page - 1))
 
 
-def st_display_branch(component, ANNOTATIONS):
-    """Display all available branches in a selectbox. Return the selectbox and the
-    branches."""
+def st_wait(component, loader, stage: str = 'ready'):
+    """Show what is being loaded until the loader reaches a stage and return the
+    annotation repository for the "annotations" stage and the model for "ready".
+    Returns None and shows the error if loading failed."""
+    placeholder = None
+    while not loader.wait(stage, timeout=0.2):
+        if placeholder is None:
+            placeholder = component.empty()
+        placeholder.info(f'Loading {loader.stage}... ({loader.seconds:.0f} seconds)')
+    if placeholder is not None:
+        placeholder.empty()
+    if loader.error is not None:
+        component.error(f'Loading the repositories failed: {loader.error}')
+        return None
+    return loader.annotations if stage == 'annotations' else loader.data
+
+
+def st_display_branch(component, ANNOTATIONS, default: str = 'main'):
+    """Display all available branches in a selectbox, with the default branch
+    selected if there is one. Return the selected branch."""
     branch_names = ANNOTATIONS.branch_names
-    index = get_index(branch_names, 'main')
+    index = get_index(branch_names, default)
     return component.selectbox('Branch in repository:', branch_names, index=index)
 
 
 def read_file(filepath: Path):
     if filepath.is_file():
         with filepath.open() as fh:
-            return fh.read()
+            content = fh.read()
+            timing.add_bytes(len(content))
+            return content
     return ''
 
 
+def scan_directory(path: Path):
+    """Return pairs of paths and booleans that say whether the path is a directory,
+    for all entries in a directory and sorted on name. For paths on disk this uses
+    os.scandir, which usually knows the type of an entry without a stat call."""
+    if isinstance(path, GitPath):
+        return [(p, p.is_dir()) for p in sorted(path.iterdir())]
+    with os.scandir(path) as entries:
+        pairs = [(entry.name, entry.is_dir()) for entry in entries]
+    return [(path / name, is_dir) for name, is_dir in sorted(pairs)]
+
+
+def parallel_map(function, items, threads: int = None):
+    """Apply a function to all items using a pool of threads and return the results
+    in the order of the items."""
+    items = list(items)
+    threads = config.LOAD_THREADS if threads is None else threads
+    if threads <= 1 or len(items) <= 1:
+        return [function(item) for item in items]
+    with ThreadPoolExecutor(max_workers=min(threads, len(items))) as executor:
+        return list(executor.map(function, items))
+
+
+def signature(path: Path):
+    """Return a cheap signature of a file or directory that changes when the path
+    changes. This is the modification time and size for paths on disk and the SHA
+    of the object for a GitPath. Returns None if the path does not exist."""
+    if isinstance(path, GitPath):
+        return path.hexsha
+    try:
+        stat = os.stat(path)
+        return [stat.st_mtime_ns, stat.st_size]
+    except OSError:
+        return None
+
+
+def file_key(path: Path):
+    """Return a key for the content of a file, this is the SHA of the blob for a
+    GitPath and the path with the size and modification time otherwise."""
+    if isinstance(path, GitPath):
+        return ('git', path.hexsha)
+    stat = path.stat()
+    return (str(path.resolve()), stat.st_size, stat.st_mtime_ns)
+
+
+def read_head(path: Path):
+    """Return the SHA of HEAD of the repository at path by reading the files in the
+    git directory, which is much faster than importing GitPython. This follows a
+    symbolic ref into the loose refs and the packed refs, and also works for linked
+    worktrees. Returns None if HEAD cannot be found this way."""
+    git_dir = Path(path) / '.git'
+    try:
+        if git_dir.is_file():
+            # a linked worktree, its .git file points at the real git directory
+            git_dir = Path(path) / git_dir.read_text().split('gitdir:', 1)[1].strip()
+        head = (git_dir / 'HEAD').read_text().strip()
+        if not head.startswith('ref:'):
+            return head or None
+        ref = head[4:].strip()
+        common_dir = git_dir
+        if (git_dir / 'commondir').is_file():
+            common_dir = git_dir / (git_dir / 'commondir').read_text().strip()
+        for directory in (git_dir, common_dir):
+            if (directory / ref).is_file():
+                return (directory / ref).read_text().strip()
+        with open(common_dir / 'packed-refs') as fh:
+            for line in fh:
+                if line.rstrip('\n').endswith(f' {ref}'):
+                    return line.split()[0]
+    except (OSError, IndexError):
+        pass
+    return None
+
+
+def memory_size(obj, seen: set = None):
+    """Return an estimate of the number of bytes used by an object and everything it
+    refers to through containers, instance dictionaries and slots. Objects in the
+    seen set are not counted again, so sizes of objects that share data can be
+    added up by handing in the same set. Classes, functions, modules, locks and
+    GitPython objects are not counted."""
+    seen = set() if seen is None else seen
+    size = 0
+    stack = [obj]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or isinstance(obj, _UNCOUNTED) or _is_git_object(obj):
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset, deque)):
+            stack.extend(obj)
+        if hasattr(obj, '__dict__'):
+            stack.append(obj.__dict__)
+        for cls in type(obj).__mro__:
+            for slot in getattr(cls, '__slots__', ()):
+                if hasattr(obj, slot):
+                    stack.append(getattr(obj, slot))
+    return size
+
+
+_UNCOUNTED = (type, type(sys), type(memory_size), type(print), type(threading.Lock()))
+
+
+def _is_git_object(obj):
+    return type(obj).__module__.split('.')[0] in ('git', 'gitdb')
+
+
+def human_size(size: int):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024 or unit == 'GB':
+            return f'{size:.0f} {unit}' if unit == 'B' else f'{size:.1f} {unit}'
+        size /= 1024
+
+
+def read_cache(name: str):
+    """Read a gzipped JSON file from the cache directory, return None if it does
+    not exist or cannot be read."""
+    path = Path(config.CACHE) / f'{name}.json.gz'
+    try:
+        with gzip.open(path, 'rt', encoding='utf8') as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return None
+
+
+def write_cache(name: str, data):
+    """Write data as gzipped JSON to the cache directory. The file is written to a
+    temporary file first so concurrent readers never see a partial file."""
+    path = Path(config.CACHE) / f'{name}.json.gz'
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f'{path.name}.{random_string()}')
+    with gzip.open(tmp_path, 'wt', encoding='utf8', compresslevel=1) as fh:
+        json.dump(data, fh, separators=(',', ':'))
+    os.replace(tmp_path, path)
+
+
 def identity(text: str):
     return text.replace('@', ' ⟹ ')
 
@@ -1,31 +1,53 @@
 
+import threading
+from collections import OrderedDict
+
 import pandas as pd
 import streamlit as st
-from directory_tree import DisplayTree
 
+import config
 import utils
+import timing
+
 
+# data frames for the history tab, indexed on the SHA of the head of a branch
+_history_frames = OrderedDict()
+_history_lock = threading.Lock()
 
-def viewer(MODEL, CHECKOUT):
 
-    ANNOTATIONS = MODEL.annotations
-    EVALUATIONS = MODEL.evaluations
+def viewer(LOADER, CHECKOUT):
 
     st.title('CLAMS Annotation Viewer')
 
+    # the annotation repository is loaded before the evaluation repository, only
+    # the batch usage tab has to wait for the complete model
+    ANNOTATIONS = utils.st_wait(st, LOADER, 'annotations')
+    if ANNOTATIONS is None:
+        return
+    # with CHECKOUT set ANNOTATIONS becomes a snapshot of a branch, branches are
+    # compared on the repository itself
+    REPOSITORY = ANNOTATIONS
+
     if CHECKOUT:
-        branch = utils.st_display_branch(st, ANNOTATIONS)
-        ANNOTATIONS.checkout(branch)
+        # this leaves the working tree alone and is shared by all sessions,
+        # switching to a branch seen before is a dictionary lookup
+        # the branch is kept in the session state, which unlike the state of a
+        # widget survives going to another page, the search page looks at it
+        branch = utils.st_display_branch(
+            st, ANNOTATIONS, st.session_state.get('annotation-branch', 'main'))
+        st.session_state['annotation-branch'] = branch
+        ANNOTATIONS = ANNOTATIONS.at_branch(branch)
 
-    readme, tasks, batches = st.tabs(['Repository readme file', 'Tasks', 'Batches'])
+    readme, tasks, batches, compare, history = st.tabs(
+        ['Repository readme file', 'Tasks', 'Batches', 'Compare branches', 'History'])
 
-    with readme:
+    with readme, timing.timer('annotation viewer: repository readme'):
         readme.markdown(ANNOTATIONS.readme)
 
-    with tasks:
+    with tasks, timing.timer('annotation viewer: tasks'):
         navigation_col, data_col = tasks.columns([0.2, 0.5])
         task = navigation_col.radio('tasks', ['overview'] + ANNOTATIONS.task_names,
-                                    label_visibility='collapsed')
+                                    label_visibility='collapsed', key='task')
         if task == 'overview':
             tasks_info = [[task.name, len(task)] for task in ANNOTATIONS.tasks]
             data_col.info('Tasks with number of gold files for each')
@@ -42,7 +64,7 @@ def viewer(MODEL, CHECKOUT):
                     ["Readme", "Gold directory", "Gold files", "Data drops",
                      "Batches", "Process.py"])
 
-            with readme_tab:
+            with readme_tab, timing.timer('annotation viewer: task readme'):
                 # TODO: any links in the readme file need to be updated for streamlit
                 # TODO: little intro saying that the stuff below is a README file from
                 # a repository and that it was not designed to be displayed in streamlit
@@ -50,43 +72,68 @@ def viewer(MODEL, CHECKOUT):
                 # (might be tricky if we are not in the main branch)
                 readme_tab.markdown(ANNOTATIONS.task(task).readme)
 
-            with gold_tab1:
-                tree = DisplayTree(task_obj.gold_directory, stringRep=True)
-                st.text_area(label='Gold directory tree', value=tree, height=800)
+            with gold_tab1, timing.timer('annotation viewer: gold directory'):
+                # the tree index is built once for each task in a snapshot, only
+                # the directories selected here are opened and printed
+                tree = task_obj.gold_tree
+                directories = []
+                queue = [tree.root]
+                while queue:
+                    directory = queue.pop(0)
+                    directories.extend(
+                        d.parts for d in directory.subdirectories.values())
+                    queue.extend(directory.subdirectories.values())
+                expanded = gold_tab1.multiselect(
+                    'Open directories', sorted(directories), format_func='/'.join,
+                    key=f'gold-tree-{task}')
+                lines = tree.lines(set(expanded), config.TREE_FILES)
+                gold_tab1.text('\n'.join(lines))
 
-            with gold_tab2:
-                selected_gold = utils.st_list_files2(gold_tab2, task_obj)
-                gold_tab2.text(task_obj.gold_content(selected_gold))
+            with gold_tab2, timing.timer('annotation viewer: gold files'):
+                selected_gold = utils.st_pick_file(
+                    gold_tab2, f'gold-files-{task}', task_obj.gold_file_names)
+                if selected_gold is not None:
+                    utils.st_display_lines(
+                        gold_tab2, task_obj.gold_directory / selected_gold)
 
-            with data_tab:
+            with data_tab, timing.timer('annotation viewer: data drops'):
                 data_drops = list(task_obj.data_drops.keys())
                 data_tab.text(f'Number of data drops: {len(data_drops)}')
-                data_drop = utils.st_list_files(
-                    data_tab, 'selected_drop', data_drops, cutoff=0)
+                data_drop = utils.st_pick_file(
+                    data_tab, f'data-drops-{task}', data_drops, cutoff=0)
                 data_drop_obj = task_obj.data_drop(data_drop)
                 if data_drop_obj is not None:
                     data_tab.text(f'Number of files in this data drop: {len(data_drop_obj)}')
-                    data_drop_file = utils.st_list_files(
-                        data_tab, 'selected_data_drop', data_drop_obj.file_names, cutoff=0)
-                    data_tab.text(data_drop_obj.file_content(data_drop_file))
+                    data_drop_file = utils.st_pick_file(
+                        data_tab, f'data-drop-files-{task}-{data_drop}',
+                        data_drop_obj.file_names, cutoff=0)
+                    if data_drop_file is not None:
+                        utils.st_display_lines(
+                            data_tab, data_drop_obj.path / data_drop_file)
 
-            with batches_tab:
+            with batches_tab, timing.timer('annotation viewer: task batches'):
                 batches_tab.markdown('##### GUIDs from annotation batches used in this task')
                 data = []
-                for batch in ANNOTATIONS.batches:
-                    comparison = task_obj.compare_to_batch(batch)
-                    data.append([batch.name, comparison.in_both, len(batch)])
+                for batch_name, comparison in ANNOTATIONS.overlaps.task_row(task):
+                    batch_size = len(ANNOTATIONS.batch(batch_name))
+                    data.append([batch_name, comparison.in_both, batch_size])
                 columns = ['batch name', 'guids', 'batch size']
                 batches_tab.table(pd.DataFrame(data, columns=columns))
 
-            with code_tab:
+            with code_tab, timing.timer('annotation viewer: process.py'):
                 code_tab.code(ANNOTATIONS.task(task).process, language='python')
 
-    with batches:
+    with compare, timing.timer('annotation viewer: compare branches'):
+        st_display_comparison(compare, REPOSITORY)
+
+    with history, timing.timer('annotation viewer: history'):
+        st_display_history(history, REPOSITORY)
+
+    with batches, timing.timer('annotation viewer: batches'):
 
         navigation_col, data_col = batches.columns([0.2, 0.5])
         batch = navigation_col.radio('batches', ['overview'] + ANNOTATIONS.batch_names,
-                                     label_visibility='collapsed')
+                                     label_visibility='collapsed', key='batch')
 
         if batch == 'overview':
             batches_info = [[batch.name, len(batch)] for batch in ANNOTATIONS.batches]
@@ -103,25 +150,28 @@ def viewer(MODEL, CHECKOUT):
                     ['File identifiers', 'Full batch file content',
                      'Annotation tasks', 'Use in evaluations'])
 
-            with files_tab:
+            with files_tab, timing.timer('annotation viewer: batch files'):
                 files_tab.text('\n'.join(ANNOTATIONS.batch(batch).files))
 
-            with content_tab:
+            with content_tab, timing.timer('annotation viewer: batch content'):
                 content_tab.markdown('##### Batch file content with file identifiers')
-                content_tab.text(ANNOTATIONS.batch(batch).content)
+                utils.st_display_lines(content_tab, ANNOTATIONS.batch(batch).path)
 
-            with task_tab:
+            with task_tab, timing.timer('annotation viewer: batch tasks'):
                 task_tab.markdown('##### Batch usage by annotation tasks')
                 task_tab.markdown('This shows how many GUIDs from this batch were used'
                                   + ' in all annotation tasks.')
                 data = []
-                for task in ANNOTATIONS.tasks:
-                    comparison = task.compare_to_batch(ANNOTATIONS.batch(batch))
-                    data.append([task.name, comparison.in_both, len(task)])
+                for task_name, comparison in ANNOTATIONS.overlaps.batch_column(batch):
+                    task_size = len(ANNOTATIONS.task(task_name))
+                    data.append([task_name, comparison.in_both, task_size])
                 columns = ['task name', 'overlap', 'task size']
                 task_tab.table(pd.DataFrame(data, columns=columns))
 
-            with preds_tab:
+            with preds_tab, timing.timer('annotation viewer: batch evaluations'):
+                MODEL = utils.st_wait(preds_tab, LOADER)
+                if MODEL is None:
+                    return
                 preds_tab.markdown('##### Batch usage in evaluation repository')
                 preds_tab.markdown('Usage in system predictions:')
                 preds_tab.table(
@@ -131,4 +181,105 @@ def viewer(MODEL, CHECKOUT):
                 preds_tab.table(
                     pd.DataFrame(MODEL.batch_usage_in_system_reports(batch),
                                  columns=['evaluation', 'system report']))
+                preds_tab.markdown('Prediction files on GUIDs from this batch:')
+                preds_tab.table(
+                    pd.DataFrame(MODEL.store.prediction_coverage(batch),
+                                 columns=['evaluation', 'system predictions', 'files']))
+
+
+def st_display_comparison(component, annotations):
+    """Show what changed between two branches in the gold files of each task, the
+    batches and the data drops, with line differences for a gold file when asked
+    for. This reads nothing from the working tree."""
+    branch_names = annotations.branch_names
+    first_col, second_col = component.columns(2)
+    first = first_col.selectbox(
+        'From branch', branch_names, index=utils.get_index(branch_names, 'main'),
+        key='compare-first')
+    second = second_col.selectbox('To branch', branch_names, key='compare-second')
+    if first == second:
+        component.info('Select two different branches to see what changed')
+        return
+    comparison = annotations.compare(first, second)
+    component.markdown('##### Gold files')
+    component.table(
+        pd.DataFrame(comparison.task_summary(),
+                     columns=['task', 'added', 'removed', 'modified']))
+    component.markdown('##### Batches')
+    batches = comparison.batches
+    component.table(
+        pd.DataFrame([[name, 'added'] for name in batches.added]
+                     + [[name, 'removed'] for name in batches.removed]
+                     + [[name, 'modified'] for name in batches.modified],
+                     columns=['batch file', 'change']))
+    component.markdown('##### Data drops')
+    component.table(
+        pd.DataFrame([[name, len(c.added), len(c.removed), len(c.modified)]
+                      for name, c in sorted(comparison.data_drops.items())],
+                     columns=['data drop', 'added', 'removed', 'modified']))
+    if not comparison.golds:
+        return
+    component.markdown('##### Changed gold files')
+    task = component.selectbox('Task', sorted(comparison.golds), key='compare-task')
+    changes = comparison.gold_changes(task)
+    gold_files = ([('added', name) for name in changes.added]
+                  + [('removed', name) for name in changes.removed]
+                  + [('modified', name) for name in changes.modified])
+    gold_file = component.selectbox(
+        'Gold file', gold_files, format_func=lambda change: f'{change[1]} ({change[0]})',
+        key='compare-gold-file')
+    if gold_file is not None and component.toggle('Show line differences'):
+        component.code(comparison.gold_diff(task, gold_file[1]), language='diff')
+
+
+def st_display_history(component, annotations):
+    """Show how the number of gold files of each task and the size of each batch
+    changed over the commits of a branch, and when data drops arrived. Streamlit
+    runs this on every rerun of the viewer, so nothing is done until the history
+    is asked for."""
+    if not component.toggle('Show the history of a branch', key='history-show'):
+        return
+    branch_names = annotations.branch_names
+    branch = component.selectbox(
+        'Branch', branch_names, index=utils.get_index(branch_names, 'main'),
+        key='history-branch')
+    frames = history_frames(annotations, branch)
+    if frames is None:
+        component.info(f'There are no commits on branch "{branch}"')
+        return
+    golds, batches, arrivals = frames
+    component.caption(
+        f'{len(golds)} commits from {golds.index[0]:%Y-%m-%d} to {golds.index[-1]:%Y-%m-%d}')
+    component.markdown('##### Gold files in each task')
+    component.line_chart(golds)
+    component.markdown('##### GUIDs in each batch')
+    component.line_chart(batches)
+    component.markdown('##### Data drop arrivals')
+    component.dataframe(arrivals, hide_index=True)
+
 
+def history_frames(annotations, branch: str):
+    """Return data frames with the gold file counts, the batch sizes and the data
+    drop arrivals for the commits of a branch, or None if there are no commits.
+    The frames are kept for the commit at the head of the branch, so git is only
+    asked for the history again when the branch moved."""
+    sha = annotations.head_commit(branch).hexsha
+    with _history_lock:
+        if sha in _history_frames:
+            _history_frames.move_to_end(sha)
+            return _history_frames[sha]
+    steps = annotations.history(branch)
+    frames = None
+    if steps:
+        times = pd.to_datetime([step.time for step in steps], unit='s')
+        frames = (
+            pd.DataFrame([step.golds for step in steps], index=times).fillna(0),
+            pd.DataFrame([step.batches for step in steps], index=times),
+            pd.DataFrame([[time, step.commit[:8], step.subject] + drop.split('/', 1)
+                          for time, step in zip(times, steps) for drop in step.arrivals],
+                         columns=['time', 'commit', 'subject', 'task', 'data drop']))
+    with _history_lock:
+        _history_frames[sha] = frames
+        while len(_history_frames) > config.HISTORY_CACHE_SIZE:
+            _history_frames.popitem(last=False)
+    return frames
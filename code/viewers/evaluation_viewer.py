@@ -1,63 +1,125 @@
+import pandas as pd
 import streamlit as st
 import utils
-import config
+import timing
 
 
-def viewer(MODEL):
+def viewer(LOADER):
 
+    st.title('CLAMS Evaluation Viewer')
+
+    MODEL = utils.st_wait(st, LOADER)
+    if MODEL is None:
+        return
     ANNOTATIONS = MODEL.annotations
     EVALUATIONS = MODEL.evaluations
-
-    st.title('CLAMS Evaluation Viewer')
     navigation_col, eval_col = st.columns([0.2, 0.8])
 
     eval_name = navigation_col.radio(
-        'eval-category', EVALUATIONS.evaluation_names, label_visibility='collapsed')
+        'eval-category', EVALUATIONS.evaluation_names, label_visibility='collapsed',
+        key='evaluation')
     evaluation = EVALUATIONS.evaluation(eval_name)
 
     eval_col.info(
         f'Evaluation "{evaluation.name}"'
         + f' with {len(evaluation.predictions)} predictions'
-        + f' and {len(evaluation.reports)} reports')
+        + f' and {len(evaluation.reports)} reports'
+        + f' on batches {", ".join(MODEL.store.batches_used_by(evaluation.name))}')
 
-    readme_tab, code_tab, predictions_tab, reports_tab = eval_col.tabs(
-        [ 'Readme', 'Code', 'Predictions', 'Reports'])
+    readme_tab, code_tab, predictions_tab, reports_tab, coverage_tab = eval_col.tabs(
+        [ 'Readme', 'Code', 'Predictions', 'Reports', 'GUID coverage'])
 
-    with readme_tab:
+    with readme_tab, timing.timer('evaluation viewer: readme'):
         readme_tab.markdown(evaluation.readme)
     
-    with code_tab:
+    with code_tab, timing.timer('evaluation viewer: code'):
         code_file_names = [f.name for f in evaluation.scripts]
         code_file = code_tab.radio(
             'code_file', code_file_names, label_visibility='collapsed')
         code_tab.code(utils.read_file(evaluation.path / code_file))
 
-    with predictions_tab:
-        prediction = utils.st_list_files(
-            predictions_tab, 'prediction', evaluation.prediction_names)
+    with predictions_tab, timing.timer('evaluation viewer: predictions'):
+        prediction = utils.st_pick_file(
+            predictions_tab, f'predictions-{eval_name}', evaluation.prediction_names)
         if prediction is not None:
             prediction_obj = evaluation.prediction(prediction)
             predictions_tab.markdown('##### Readme file')
             prediction_obj.readme
             prediction_files = prediction_obj.file_names()
+            if predictions_tab.toggle('Show summary of all prediction files'):
+                st_display_summary(predictions_tab, prediction_obj)
             predictions_tab.markdown('##### Prediction files')
             predictions_tab.markdown(f'&nbsp;*{len(prediction_files)} files*')
-            prediction_file = utils.st_list_files(
-                predictions_tab, 'prediction_files', prediction_files)
-            path = evaluation.path / prediction / prediction_file
-            file_size = path.stat().st_size
-            predictions_tab.markdown(f'*File size: {file_size:,}*')
-            if file_size < config.MAX_FILESIZE:
-                utils.st_display_file(predictions_tab, path)
-            else:
-                predictions_tab.markdown(f'*This file is rather big, print it anyway?*')
-                print_file = predictions_tab.button('Print File')
-                if print_file:
-                    utils.st_display_file(predictions_tab, path)
+            prediction_file = utils.st_pick_file(
+                predictions_tab, f'prediction-files-{eval_name}-{prediction}',
+                prediction_files)
+            if prediction_file is not None:
+                path = evaluation.path / prediction / prediction_file
+                file_size = path.stat().st_size
+                predictions_tab.markdown(f'*File size: {file_size:,}*')
+                # the file is read one page at a time, so size does not matter
+                utils.st_display_mmif(predictions_tab, path)
     
-    with reports_tab:
-        report = utils.st_list_files(
-            reports_tab, 'report', evaluation.reports.keys())
+    with reports_tab, timing.timer('evaluation viewer: reports'):
+        report = utils.st_pick_file(
+            reports_tab, f'reports-{eval_name}', list(evaluation.reports))
         if report is not None:
-            # TODO: could now use the Report object for this
-            reports_tab.markdown(utils.read_file(evaluation.path / report))
+            report_obj = evaluation.reports[report]
+            reports_tab.caption(
+                f'Report by {report_obj.report_tool} on batch {report_obj.report_batch}'
+                + f' for predictions {report_obj.prediction_name}')
+            reports_tab.markdown(report_obj.content)
+            if reports_tab.toggle('Show metrics from the tables in this report'):
+                reports_tab.dataframe(
+                    pd.DataFrame(report_obj.metrics(),
+                                 columns=['table', 'label', 'metric', 'value']),
+                    hide_index=True)
+
+
+    with coverage_tab, timing.timer('evaluation viewer: coverage'):
+        st_display_coverage(coverage_tab, MODEL, evaluation.name)
+
+def st_display_summary(component, prediction):
+    """Show a table with a summary of each MMIF file in a prediction batch and the
+    totals for each annotation type."""
+    with component.spinner('Summarizing prediction files...'):
+        summaries = prediction.summary()
+    rows = []
+    types = {}
+    for summary in summaries:
+        if 'failed' in summary:
+            rows.append([summary['file'], None, None, None, '', '', summary['failed']])
+            continue
+        for annotation_type, count in summary['types'].items():
+            types[annotation_type] = types.get(annotation_type, 0) + count
+        rows.append([
+            summary['file'], summary['documents'], summary['views'],
+            summary['annotations'], ' '.join(str(app) for app in summary['apps']),
+            ' '.join(summary['errors']), ' '.join(summary['warnings'])])
+    columns = ['file', 'documents', 'views', 'annotations', 'apps', 'errors', 'warnings']
+    component.markdown('##### Summary of prediction files')
+    component.dataframe(pd.DataFrame(rows, columns=columns), hide_index=True)
+    component.dataframe(
+        pd.DataFrame(sorted(types.items()), columns=['annotation type', 'count']),
+        hide_index=True)
+
+
+def st_display_coverage(component, MODEL, evaluation_name: str):
+    """Show for each prediction batch of an evaluation how many GUIDs from its
+    annotation batch have no prediction, how many predictions have no gold file
+    and how many GUIDs have a gold file but no prediction, with the GUIDs for one
+    prediction batch on request."""
+    coverage = MODEL.coverage()
+    component.markdown('##### GUID coverage of the prediction batches')
+    rows = coverage.evaluation_rows(evaluation_name)
+    component.dataframe(
+        pd.DataFrame([row[1:] for row in rows], columns=coverage.COLUMNS[1:]),
+        hide_index=True)
+    if not rows:
+        return
+    prediction = component.selectbox(
+        'Prediction batch', [row[1] for row in rows], key='coverage-prediction')
+    kind = component.radio(
+        'GUIDs', coverage.KINDS, horizontal=True, key='coverage-kind')
+    guids = coverage.guids(evaluation_name, prediction, kind)
+    component.text('\n'.join(guids) if guids else 'None')
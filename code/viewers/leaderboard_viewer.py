@@ -0,0 +1,46 @@
+
+import pandas as pd
+import streamlit as st
+
+import utils
+import evaluation
+import timing
+
+
+def viewer(LOADER):
+
+    st.title('CLAMS Leaderboard')
+
+    MODEL = utils.st_wait(st, LOADER)
+    if MODEL is None:
+        return
+    EVALUATIONS = MODEL.evaluations
+
+    with timing.timer('leaderboard viewer: update'):
+        # only reports that changed since the last rerun are parsed again
+        rows = EVALUATIONS.leaderboard()
+    if not rows:
+        st.info('There are no tables with numbers in the evaluation reports')
+        return
+    metrics = pd.DataFrame(rows, columns=evaluation.Leaderboard.COLUMNS)
+    st.info(
+        f'Metrics from {metrics.evaluation.nunique()} evaluations'
+        + f' on {metrics.batch.nunique()} batches, with one column for each batch'
+        + ' and systems sorted on their average')
+
+    with timing.timer('leaderboard viewer: table'):
+        metric_col, label_col, table_col, tool_col = st.columns(4)
+        metric = metric_col.selectbox('Metric', sorted(metrics.metric.unique()))
+        metrics = metrics[metrics.metric == metric]
+        label = label_col.selectbox('Label', sorted(metrics.label.unique()))
+        metrics = metrics[metrics.label == label]
+        table = table_col.selectbox('Report table', sorted(metrics.table.unique()))
+        metrics = metrics[metrics.table == table]
+        tool = tool_col.selectbox('Report tool', ['all'] + sorted(metrics.tool.unique()))
+        if tool != 'all':
+            metrics = metrics[metrics.tool == tool]
+        board = metrics.pivot_table(
+            index=['evaluation', 'prediction', 'tool'], columns='batch',
+            values='value', aggfunc='max')
+        board['average'] = board.mean(axis=1)
+        st.dataframe(board.sort_values('average', ascending=False))
@@ -0,0 +1,102 @@
+
+import streamlit as st
+
+import utils
+import search
+import timing
+
+
+# Keys of the radio buttons in the viewers that select the task, batch or
+# evaluation a hit is in, these are set when a hit is opened.
+TARGETS = {
+    'task readme': 'task',
+    'task process': 'task',
+    'gold file': 'task',
+    'batch comment': 'batch',
+    'evaluation readme': 'evaluation',
+    'report': 'evaluation' }
+
+# Keys of the file pickers that list the file of a hit, see utils.st_pick_file().
+PICKERS = {
+    'gold file': 'gold-files',
+    'report': 'reports' }
+
+
+def viewer(LOADER, CHECKOUT):
+
+    st.title('CLAMS Search')
+
+    MODEL = utils.st_wait(st, LOADER)
+    if MODEL is None:
+        return
+
+    query = st.text_input(
+        'Search', placeholder='Search readmes, process code, batch comments,'
+        + ' gold files and reports', label_visibility='collapsed')
+    if not query:
+        st.info('All words have to be in a document, hits are ranked on how often'
+                + ' the words are in it and how rare they are')
+        return
+
+    with timing.timer('search viewer: query'):
+        hits = MODEL.search(query)
+    if not hits:
+        st.info(f'Nothing found for "{query}"')
+        return
+    # the annotation repository is indexed as it is in the working tree, while
+    # the annotation viewer shows a branch, see annotation_viewer.viewer()
+    branch = None
+    if CHECKOUT:
+        branch_names = MODEL.annotations.branch_names
+        branch = branch_names[
+            utils.get_index(branch_names, st.session_state.get('annotation-branch', 'main'))]
+        BRANCH = MODEL.annotations.at_branch(branch)
+        st.caption(f'{len(hits)} best hits, hits in the annotation repository are from'
+                   + f' the working tree and the annotation viewer shows branch "{branch}"')
+    else:
+        st.caption(f'{len(hits)} best hits')
+
+    with timing.timer('search viewer: hits'):
+        for number, hit in enumerate(hits):
+            document = hit.document
+            page, tab = search.KINDS[document.kind]
+            text_col, button_col = st.columns([0.85, 0.15])
+            location = ' / '.join(part for part in (document.target, document.name) if part)
+            source = ', working tree' if branch and page == 'Annotation viewer' else ''
+            text_col.markdown(f'**{location}** &nbsp; *{document.kind}, {tab} tab{source}*')
+            text_col.text(hit.snippet)
+            missing = branch is not None and not on_branch(document, BRANCH)
+            if missing:
+                text_col.warning(f'Not on branch "{branch}", select another branch in'
+                                 + ' the annotation viewer to see this')
+            button_col.button(
+                f'Open in {page.lower()}', key=f'search-hit-{number}',
+                on_click=open_hit, args=(hit,), disabled=missing)
+
+
+def on_branch(document: search.Document, annotations):
+    """Return whether the task, batch or gold file of a hit is in the annotation
+    repository on a branch. Hits outside of the annotation repository always are."""
+    target = TARGETS.get(document.kind)
+    if target == 'task':
+        if document.target not in annotations.task_names:
+            return False
+        if document.kind == 'gold file':
+            return document.name in annotations.task(document.target).gold_file_names
+    elif target == 'batch':
+        return document.target in annotations.batch_names
+    return True
+
+
+def open_hit(hit):
+    """Go to the viewer page of a hit and select its task, batch or evaluation, and
+    for gold files and reports the file itself."""
+    document = hit.document
+    st.session_state['dashboard'] = search.KINDS[document.kind][0]
+    if document.kind in TARGETS:
+        st.session_state[TARGETS[document.kind]] = document.target
+    if document.kind in PICKERS:
+        # the prefix finds the file in a long listing, the file is then selected
+        key = f'{PICKERS[document.kind]}-{document.target}'
+        st.session_state[f'{key}-prefix'] = document.name
+        st.session_state[f'{key}-file'] = document.name